@@ -14,11 +14,19 @@ from .nodes.create_image_edit_node import NODE_DISPLAY_NAME_MAPPINGS as CREATE_I
 
 # 新增的视频处理节点
 from .nodes.smart_video_combiner import SmartVideoCombinerNode, NODE_CLASS_MAPPINGS as SMART_VIDEO_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as SMART_VIDEO_DISPLAY_MAPPINGS
+from .nodes.smart_video_edl_render import SmartVideoEDLRenderNode, NODE_CLASS_MAPPINGS as EDL_RENDER_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as EDL_RENDER_DISPLAY_MAPPINGS
 from .nodes.video_subtitle_generator import VideoSubtitleGeneratorNode, NODE_CLASS_MAPPINGS as SUBTITLE_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as SUBTITLE_DISPLAY_MAPPINGS
 from .nodes.image_to_video import ImageToVideoNode, NODE_CLASS_MAPPINGS as IMAGE_VIDEO_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as IMAGE_VIDEO_DISPLAY_MAPPINGS
 from .nodes.video_audio_remover import VideoAudioRemoverNode, NODE_CLASS_MAPPINGS as AUDIO_REMOVER_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as AUDIO_REMOVER_DISPLAY_MAPPINGS
 from .nodes.video_background_music import VideoBackgroundMusicNode, NODE_CLASS_MAPPINGS as BGM_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as BGM_DISPLAY_MAPPINGS
 
+# 插件加载时清理崩溃遗留的临时工作目录，不等到第一个任务运行
+from .nodes.scratch_space import get_scratch_space
+try:
+    get_scratch_space()
+except OSError as e:
+    print(f"初始化临时工作空间失败: {str(e)}")
+
 # 告诉 ComfyUI 从哪里加载前端扩展
 import os
 WEB_DIRECTORY = os.path.join(os.path.dirname(os.path.realpath(__file__)), "web")
@@ -42,6 +50,7 @@ NODE_CLASS_MAPPINGS.update(CREATE_IMAGE_EDIT_MAPPINGS)
 NODE_CLASS_MAPPINGS.update(SAVE_AUDIO_MAPPINGS)
 NODE_CLASS_MAPPINGS.update(SAVE_TEXT_MAPPINGS)
 NODE_CLASS_MAPPINGS.update(SMART_VIDEO_MAPPINGS)
+NODE_CLASS_MAPPINGS.update(EDL_RENDER_MAPPINGS)
 NODE_CLASS_MAPPINGS.update(SUBTITLE_MAPPINGS)
 NODE_CLASS_MAPPINGS.update(IMAGE_VIDEO_MAPPINGS)
 NODE_CLASS_MAPPINGS.update(AUDIO_REMOVER_MAPPINGS)
@@ -66,6 +75,7 @@ NODE_DISPLAY_NAME_MAPPINGS.update(CREATE_IMAGE_EDIT_DISPLAY_MAPPINGS)
 NODE_DISPLAY_NAME_MAPPINGS.update(SAVE_AUDIO_DISPLAY_MAPPINGS)
 NODE_DISPLAY_NAME_MAPPINGS.update(SAVE_TEXT_DISPLAY_MAPPINGS)
 NODE_DISPLAY_NAME_MAPPINGS.update(SMART_VIDEO_DISPLAY_MAPPINGS)
+NODE_DISPLAY_NAME_MAPPINGS.update(EDL_RENDER_DISPLAY_MAPPINGS)
 NODE_DISPLAY_NAME_MAPPINGS.update(SUBTITLE_DISPLAY_MAPPINGS)
 NODE_DISPLAY_NAME_MAPPINGS.update(IMAGE_VIDEO_DISPLAY_MAPPINGS)
 NODE_DISPLAY_NAME_MAPPINGS.update(AUDIO_REMOVER_DISPLAY_MAPPINGS)
@@ -1,6 +1,4 @@
 import os
-import boto3
-from botocore.exceptions import ClientError
 import folder_paths
 
 class AwsS3UploadNode:
@@ -30,6 +28,10 @@ class AwsS3UploadNode:
 
     def upload_to_s3(self, bucket, access_key, secret_key, region, parent_directory, file_path, 
                      sub_dir_name="", url_type="public", custom_domain="", presigned_expiry=3600):
+        # boto3导入较慢，在首次执行时再导入，不影响ComfyUI启动
+        import boto3
+        from botocore.exceptions import ClientError
+        
         # 检查文件是否存在
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"文件不存在: {file_path}")
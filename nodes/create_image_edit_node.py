@@ -7,7 +7,6 @@ import os
 import base64
 import io
 import json
-import requests
 import numpy as np
 import torch
 from PIL import Image
@@ -54,6 +53,9 @@ class CreateImageEditNode:
         """
         调用 OpenAI 图像编辑 API 编辑图像
         """
+        # requests在首次执行时再导入，不影响ComfyUI启动
+        import requests
+        
         print(f"got prompt: {prompt}")
         
         # 确保seed是有效的整数值
@@ -0,0 +1,213 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from .media_probe import get_cache_dir
+
+# 自然排序使用的预编译正则，避免每个文件重复编译
+_NATURAL_SORT_PATTERN = re.compile(r'(\d+)')
+
+
+def natural_sort_key(filename):
+    """自然排序键：文件名中的数字部分按数值比较"""
+    parts = _NATURAL_SORT_PATTERN.split(os.path.basename(filename).lower())
+    # 奇数位置一定是数字部分
+    for i in range(1, len(parts), 2):
+        parts[i] = int(parts[i])
+    return parts
+
+
+class DirectoryIndex:
+    """
+    目录索引 - 持久化保存素材目录的文件列表和视频探测元数据
+    目录修改时间未变化时直接使用已排序的文件列表；
+    目录发生变化时用 os.scandir 增量刷新，未变化文件的元数据继续保留
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(get_cache_dir(), "directory_index.sqlite")
+        self._lock = threading.Lock()
+        self._conn = None
+        self._db_disabled = False
+        # 数据库不可用时使用的内存索引
+        self._memory_dirs = {}
+        self._memory_entries = {}
+
+    def _connect(self):
+        """打开SQLite连接，失败时退化为仅内存索引"""
+        if self._conn is not None or self._db_disabled:
+            return self._conn
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS directories ("
+                "path TEXT PRIMARY KEY, mtime_ns INTEGER, names TEXT, updated REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "directory TEXT, name TEXT, size INTEGER, mtime_ns INTEGER, info TEXT, "
+                "PRIMARY KEY (directory, name))"
+            )
+            conn.commit()
+            self._conn = conn
+        except sqlite3.Error as e:
+            print(f"目录索引不可用，仅使用内存索引: {str(e)}")
+            self._db_disabled = True
+        return self._conn
+
+    def _load_directory(self, directory):
+        """读取目录记录，返回 (mtime_ns, 已排序文件名列表) 或None"""
+        conn = self._connect()
+        if conn is None:
+            return self._memory_dirs.get(directory)
+        row = conn.execute(
+            "SELECT mtime_ns, names FROM directories WHERE path = ?", (directory,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def _load_entries(self, directory):
+        """读取目录下所有文件记录：name -> (size, mtime_ns, info)"""
+        conn = self._connect()
+        if conn is None:
+            return dict(self._memory_entries.get(directory, {}))
+        rows = conn.execute(
+            "SELECT name, size, mtime_ns, info FROM entries WHERE directory = ?", (directory,)
+        ).fetchall()
+        return {name: (size, mtime_ns, info) for name, size, mtime_ns, info in rows}
+
+    def _save(self, directory, mtime_ns, names, entries):
+        """保存目录记录和文件记录"""
+        conn = self._connect()
+        if conn is None:
+            self._memory_dirs[directory] = (mtime_ns, names)
+            self._memory_entries[directory] = entries
+            return
+        conn.execute("DELETE FROM entries WHERE directory = ?", (directory,))
+        conn.executemany(
+            "INSERT INTO entries (directory, name, size, mtime_ns, info) VALUES (?, ?, ?, ?, ?)",
+            [(directory, name, size, mtime, info) for name, (size, mtime, info) in entries.items()]
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO directories (path, mtime_ns, names, updated) VALUES (?, ?, ?, ?)",
+            (directory, mtime_ns, json.dumps(names), time.time())
+        )
+        conn.commit()
+
+    def _refresh(self, directory, mtime_ns):
+        """用 os.scandir 增量刷新目录索引，返回已排序的文件名列表"""
+        previous = self._load_entries(directory)
+        entries = {}
+        with os.scandir(directory) as iterator:
+            for entry in iterator:
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                old = previous.get(entry.name)
+                # 大小和修改时间未变化的文件保留已有的探测元数据
+                info = old[2] if old and old[0] == stat.st_size and old[1] == stat.st_mtime_ns else None
+                entries[entry.name] = (stat.st_size, stat.st_mtime_ns, info)
+
+        names = sorted(entries, key=natural_sort_key)
+        self._save(directory, mtime_ns, names, entries)
+        return names
+
+    def list_files(self, directory, extensions):
+        """返回目录中指定扩展名的文件（自然排序的绝对路径）"""
+        directory = os.path.abspath(directory)
+        extensions = {ext.strip().lower().lstrip('.') for ext in extensions if ext.strip()}
+        mtime_ns = os.stat(directory).st_mtime_ns
+
+        with self._lock:
+            try:
+                cached = self._load_directory(directory)
+                if cached is not None and cached[0] == mtime_ns:
+                    names = cached[1]
+                else:
+                    names = self._refresh(directory, mtime_ns)
+            except sqlite3.Error as e:
+                print(f"读取目录索引失败，直接扫描目录: {str(e)}")
+                names = sorted(
+                    (entry.name for entry in os.scandir(directory) if entry.is_file()),
+                    key=natural_sort_key
+                )
+
+        result = []
+        for name in names:
+            file_ext = name.lower().rsplit('.', 1)[-1] if '.' in name else ''
+            if file_ext in extensions:
+                result.append(os.path.join(directory, name))
+        return result
+
+    def get_info(self, file_path):
+        """读取文件的探测元数据，文件已变化或没有记录时返回None"""
+        file_path = os.path.abspath(file_path)
+        directory, name = os.path.split(file_path)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                record = self._memory_entries.get(directory, {}).get(name)
+            else:
+                try:
+                    record = conn.execute(
+                        "SELECT size, mtime_ns, info FROM entries WHERE directory = ? AND name = ?",
+                        (directory, name)
+                    ).fetchone()
+                except sqlite3.Error:
+                    return None
+
+        if not record or record[2] is None:
+            return None
+        if record[0] != stat.st_size or record[1] != stat.st_mtime_ns:
+            return None
+        return json.loads(record[2])
+
+    def set_info(self, file_path, info):
+        """保存文件的探测元数据"""
+        file_path = os.path.abspath(file_path)
+        directory, name = os.path.split(file_path)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return
+
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                self._memory_entries.setdefault(directory, {})[name] = (
+                    stat.st_size, stat.st_mtime_ns, json.dumps(info)
+                )
+                return
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (directory, name, size, mtime_ns, info) VALUES (?, ?, ?, ?, ?)",
+                    (directory, name, stat.st_size, stat.st_mtime_ns, json.dumps(info))
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"写入目录索引失败: {str(e)}")
+
+
+_directory_index = None
+_directory_index_lock = threading.Lock()
+
+
+def get_directory_index():
+    """获取进程内共享的目录索引"""
+    global _directory_index
+    with _directory_index_lock:
+        if _directory_index is None:
+            _directory_index = DirectoryIndex()
+        return _directory_index
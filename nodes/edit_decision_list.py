@@ -0,0 +1,91 @@
+import os
+import json
+from .segment_plan import SegmentPlan
+
+EDL_VERSION = 1
+
+
+def build_edl(plan, orders, seeds, settings):
+    """把切片计划和每个变体的片段顺序导出为JSON剪辑决策表（EDL）
+
+    settings保存渲染需要的参数（音频、分辨率、过渡效果等），
+    源视频同时记录文件大小和修改时间，渲染时用于检查素材是否被修改
+    """
+    sources = []
+    for source_path, source_info in plan.sources:
+        try:
+            stat = os.stat(source_path)
+            size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        except OSError:
+            size, mtime_ns = None, None
+        sources.append({
+            'path': os.path.abspath(source_path),
+            'size': size,
+            'mtime_ns': mtime_ns,
+            'duration': source_info.get('duration'),
+            'width': source_info.get('width'),
+            'height': source_info.get('height'),
+            'fps': source_info.get('fps'),
+        })
+
+    clips = []
+    for index in range(len(plan)):
+        segment = plan[index]
+        clips.append({
+            'source': plan.source_index(index),
+            'in': round(segment['start_time'], 6),
+            'out': round(segment['end_time'], 6),
+            'stream_copy': segment['stream_copy'],
+        })
+
+    edl = {
+        'version': EDL_VERSION,
+        'settings': settings,
+        'sources': sources,
+        'clips': clips,
+        'variants': [{'seed': seed, 'order': list(order)} for seed, order in zip(seeds, orders)],
+    }
+    return json.dumps(edl, ensure_ascii=False)
+
+
+def load_edl(edl_json):
+    """解析剪辑决策表，返回 (切片计划, 各变体片段顺序, 各变体种子, 渲染参数)"""
+    try:
+        edl = json.loads(edl_json)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"剪辑决策表不是有效的JSON: {str(e)}")
+
+    if not isinstance(edl, dict) or edl.get('version') != EDL_VERSION:
+        raise ValueError(f"不支持的剪辑决策表版本: {edl.get('version') if isinstance(edl, dict) else None}")
+
+    plan = SegmentPlan()
+    for source in edl['sources']:
+        path = source['path']
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise FileNotFoundError(f"剪辑决策表中的视频文件不存在: {path}")
+        if source.get('size') is not None and (stat.st_size, stat.st_mtime_ns) != (source['size'], source['mtime_ns']):
+            print(f"警告: 视频文件在生成剪辑决策表后被修改: {path}")
+        plan.add_source(path, {
+            'duration': source.get('duration'),
+            'width': source.get('width'),
+            'height': source.get('height'),
+            'fps': source.get('fps'),
+        })
+
+    for clip in edl['clips']:
+        plan.append(clip['source'], clip['in'], clip['out'], clip.get('stream_copy', False))
+
+    orders = []
+    seeds = []
+    for variant in edl['variants']:
+        order = [index for index in variant['order'] if 0 <= index < len(plan)]
+        if len(order) != len(variant['order']):
+            raise ValueError("剪辑决策表中的片段顺序引用了不存在的片段")
+        orders.append(order)
+        seeds.append(variant.get('seed'))
+
+    if not orders:
+        raise ValueError("剪辑决策表中没有变体")
+    return plan, orders, seeds, edl.get('settings', {})
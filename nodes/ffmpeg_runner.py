@@ -0,0 +1,172 @@
+import io
+import os
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from .toolchain import get_toolchain
+
+try:
+    import comfy.utils
+    import comfy.model_management
+    ProcessingInterrupted = comfy.model_management.InterruptProcessingException
+except ImportError:
+    # 不在ComfyUI中运行时（例如分布式工作进程、命令行调试）没有进度条和中断
+    comfy = None
+
+    class ProcessingInterrupted(Exception):
+        pass
+
+# 错误信息只保留FFmpeg标准错误输出的最后若干行
+STDERR_TAIL_LINES = 50
+# 检查中断和超时的间隔（秒）
+POLL_INTERVAL = 0.25
+
+
+def create_progress_bar(total):
+    """创建ComfyUI进度条，不在ComfyUI中运行时返回None"""
+    if comfy is None or total <= 0:
+        return None
+    return comfy.utils.ProgressBar(total)
+
+
+def is_interrupted():
+    """当前提示词是否已被用户中断"""
+    return comfy is not None and comfy.model_management.processing_interrupted()
+
+
+def check_interrupted(cancel_event=None):
+    """用户中断或cancel_event被设置时抛出ComfyUI的中断异常
+
+    不使用 throw_exception_if_processing_interrupted()：它会清除中断标志，
+    并行运行的其他FFmpeg任务就检测不到中断了（ComfyUI在执行下一个提示词前会重置标志）
+    """
+    if is_interrupted() or (cancel_event is not None and cancel_event.is_set()):
+        raise ProcessingInterrupted()
+
+
+def concat_file_line(path):
+    """生成concat分离器列表中的 file 行：单引号内的内容按原样读取，路径中的单引号写成 '\\''"""
+    quoted = os.path.abspath(path).replace("'", "'\\''")
+    return f"file '{quoted}'\n"
+
+
+def _with_progress_args(cmd):
+    """在ffmpeg命令中加入 -progress pipe:1，进度以键值对形式写入标准输出"""
+    toolchain = get_toolchain()
+    if not cmd or cmd[0] != toolchain.ffmpeg or "-progress" in cmd or not toolchain.supports('progress'):
+        return list(cmd)
+    return [cmd[0], '-nostats', '-progress', 'pipe:1'] + list(cmd[1:])
+
+
+def _kill_process_group(process):
+    """结束FFmpeg及其子进程"""
+    if process.poll() is not None:
+        return
+    try:
+        if os.name == "nt":
+            process.kill()
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    process.wait()
+
+
+def run_ffmpeg(cmd, timeout=None, duration=None, progress=True, check=False, input_chunks=None, cancel_event=None):
+    """运行FFmpeg命令，返回 subprocess.CompletedProcess（stderr只包含最后若干行）
+
+    duration为输出时长（秒）时根据 -progress 输出驱动ComfyUI进度条；
+    input_chunks为bytes的可迭代对象时在后台线程中逐块写入FFmpeg标准输入（命令中使用 -i -），
+    生成输入时抛出的异常在FFmpeg结束后重新抛出；
+    cancel_event（threading.Event）被设置时与用户中断一样结束FFmpeg，用于并行任务之间互相取消；
+    用户中断提示词时立即结束FFmpeg进程组并抛出中断异常，超时抛出 subprocess.TimeoutExpired，
+    check为True且FFmpeg执行失败时抛出 subprocess.CalledProcessError
+    """
+    cmd = _with_progress_args(cmd)
+    popen_args = {}
+    if os.name == "nt":
+        popen_args['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        popen_args['start_new_session'] = True
+
+    process = subprocess.Popen(
+        cmd, stdin=subprocess.PIPE if input_chunks is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, **popen_args
+    )
+
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    state = {'out_time': 0.0, 'input_error': None}
+
+    def read_stderr():
+        for line in io.TextIOWrapper(process.stderr, encoding='utf-8', errors='replace'):
+            stderr_tail.append(line)
+
+    def read_progress():
+        for line in io.TextIOWrapper(process.stdout, encoding='utf-8', errors='replace'):
+            key, _, value = line.strip().partition("=")
+            if key == "out_time_us" and value.isdigit():
+                state['out_time'] = int(value) / 1000000.0
+
+    def write_input():
+        try:
+            for chunk in input_chunks:
+                process.stdin.write(chunk)
+        except OSError:
+            # FFmpeg已退出（执行失败或被中断），错误由返回码报告
+            pass
+        except Exception as e:
+            state['input_error'] = e
+            _kill_process_group(process)
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    readers = [threading.Thread(target=read_stderr, daemon=True), threading.Thread(target=read_progress, daemon=True)]
+    if input_chunks is not None:
+        readers.append(threading.Thread(target=write_input, daemon=True))
+    for reader in readers:
+        reader.start()
+
+    progress_bar = None
+    reported = -1
+    started = time.time()
+    try:
+        while process.poll() is None:
+            try:
+                process.wait(timeout=POLL_INTERVAL)
+            except subprocess.TimeoutExpired:
+                pass
+
+            # 中断时由finally结束FFmpeg进程组
+            check_interrupted(cancel_event)
+            if timeout is not None and time.time() - started > timeout:
+                _kill_process_group(process)
+                raise subprocess.TimeoutExpired(cmd, timeout, stderr="".join(stderr_tail))
+
+            if progress and duration:
+                total = max(1, int(duration))
+                if progress_bar is None:
+                    progress_bar = create_progress_bar(total)
+                current = min(total, int(state['out_time']))
+                if progress_bar is not None and current != reported:
+                    progress_bar.update_absolute(current, total)
+                    reported = current
+    finally:
+        # 调用方异常退出时也不留下FFmpeg进程
+        _kill_process_group(process)
+        for reader in readers:
+            reader.join(timeout=5)
+
+    if state['input_error'] is not None:
+        raise state['input_error']
+    if progress_bar is not None and process.returncode == 0:
+        total = max(1, int(duration))
+        progress_bar.update_absolute(total, total)
+    stderr = "".join(stderr_tail)
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, output="", stderr=stderr)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout="", stderr=stderr)
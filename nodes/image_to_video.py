@@ -1,13 +1,11 @@
 import os
-import tempfile
-import shutil
 import folder_paths
 import glob
 import re
-from moviepy.editor import VideoFileClip, ImageClip, concatenate_videoclips
 from PIL import Image
 import numpy as np
-import gc
+from .ffmpeg_runner import run_ffmpeg, ProcessingInterrupted
+from .toolchain import get_toolchain
 
 class ImageToVideoNode:
     """
@@ -126,35 +124,15 @@ class ImageToVideoNode:
     def _create_single_video(self, image_path, output_path, clip_duration, 
                            output_width, output_height, zoom_effect, zoom_factor, fps):
         """为单个图片创建视频"""
-        
         try:
-            # 创建图片剪辑
-            clip = ImageClip(image_path).set_duration(clip_duration).set_position("center")
-            
-            # 调整图片尺寸
-            clip = self._resize_image_clip(clip, output_width, output_height)
-            
-            # 应用缩放效果
-            if zoom_effect:
-                clip = self._apply_zoom_effect(clip, zoom_factor, clip_duration)
-            
-            # 创建最终视频
-            final_clip = concatenate_videoclips([clip])
-            
-            # 输出视频
-            final_clip.write_videofile(
-                output_path,
-                fps=fps,
-                codec='libx264',
-                logger=None
+            self._render_video(
+                [image_path], output_path, clip_duration, output_width, output_height,
+                zoom_effect, zoom_factor, fps
             )
-            
-            # 清理资源
-            clip.close()
-            final_clip.close()
-            
             print(f"图片视频已保存: {output_path}")
             
+        except ProcessingInterrupted:
+            raise
         except Exception as e:
             print(f"处理图片失败 {image_path}: {str(e)}")
             raise
@@ -162,99 +140,118 @@ class ImageToVideoNode:
     def _create_combined_video(self, image_paths, output_path, clip_duration, 
                              output_width, output_height, zoom_effect, zoom_factor, fps):
         """创建合并的视频"""
-        
         try:
-            clips = []
-            
-            for image_path in image_paths:
-                print(f"处理图片: {image_path}")
-                
-                # 创建图片剪辑
-                clip = ImageClip(image_path).set_duration(clip_duration).set_position("center")
-                
-                # 调整图片尺寸
-                clip = self._resize_image_clip(clip, output_width, output_height)
-                
-                # 应用缩放效果
-                if zoom_effect:
-                    clip = self._apply_zoom_effect(clip, zoom_factor, clip_duration)
-                
-                clips.append(clip)
-            
-            # 按顺序连接所有剪辑
-            final_clip = concatenate_videoclips(clips)
-            
-            # 输出视频
-            final_clip.write_videofile(
-                output_path,
-                fps=fps,
-                codec='libx264',
-                logger=None
+            self._render_video(
+                image_paths, output_path, clip_duration, output_width, output_height,
+                zoom_effect, zoom_factor, fps
             )
-            
-            # 清理资源
-            for clip in clips:
-                clip.close()
-            final_clip.close()
-            
             print(f"合并视频已保存: {output_path}")
             
+        except ProcessingInterrupted:
+            raise
         except Exception as e:
             print(f"创建合并视频失败: {str(e)}")
             raise
 
-    def _resize_image_clip(self, clip, target_width, target_height):
-        """调整图片剪辑尺寸"""
+    def _render_video(self, image_paths, output_path, clip_duration,
+                      output_width, output_height, zoom_effect, zoom_factor, fps):
+        """
+        逐帧生成画面并通过标准输入写入同一个FFmpeg编码进程
+        每次只在内存中保留一张图片的画布和当前帧，内存占用与视频时长无关
+        """
+        frame_count = max(1, int(round(clip_duration * fps)))
         
-        # 获取原始尺寸
-        clip_w, clip_h = clip.size
+        cmd = [
+            get_toolchain().ffmpeg, '-y',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+            '-s', f'{output_width}x{output_height}', '-r', str(fps),
+            '-i', '-',
+            '-an', '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
+            output_path
+        ]
         
-        # 计算缩放比例
-        scale_w = target_width / clip_w
-        scale_h = target_height / clip_h
+        def frames():
+            for image_path in image_paths:
+                print(f"处理图片: {image_path}")
+                yield from self._generate_frames(
+                    image_path, frame_count, fps, clip_duration, output_width, output_height,
+                    zoom_effect, zoom_factor
+                )
         
-        # 选择较小的缩放比例以保持宽高比
-        scale = min(scale_w, scale_h)
+        result = run_ffmpeg(cmd, duration=frame_count * len(image_paths) / fps, input_chunks=frames())
+        if result.returncode != 0:
+            raise RuntimeError(f"视频编码失败: {result.stderr}")
+        if not os.path.exists(output_path):
+            raise RuntimeError("输出视频文件不存在")
+
+    def _generate_frames(self, image_path, frame_count, fps, clip_duration,
+                         output_width, output_height, zoom_effect, zoom_factor):
+        """生成单张图片的所有帧（rgb24原始数据）"""
+        canvas_scale = self._get_canvas_scale(image_path, output_width, output_height, zoom_effect, zoom_factor)
+        canvas = self._create_canvas(image_path, output_width, output_height, canvas_scale)
         
-        # 计算新尺寸
-        new_width = int(clip_w * scale)
-        new_height = int(clip_h * scale)
+        if not zoom_effect:
+            # 静止画面每帧都相同，只转换一次
+            frame = canvas.tobytes()
+            for _ in range(frame_count):
+                yield frame
+        else:
+            for box in self._get_zoom_boxes(frame_count, fps, clip_duration, zoom_factor,
+                                            canvas.width, canvas.height):
+                yield canvas.resize((output_width, output_height), Image.BILINEAR, box=tuple(box)).tobytes()
         
-        # 调整图片尺寸
-        resized_clip = clip.resize((new_width, new_height))
+        canvas.close()
+
+    def _get_canvas_scale(self, image_path, target_width, target_height, zoom_effect, zoom_factor):
+        """
+        计算画布相对输出分辨率的放大倍数
+        缩放效果需要在更高分辨率的画布上裁剪才能保持清晰，但不超过图片本身的像素
+        """
+        if not zoom_effect:
+            return 1.0
+        with Image.open(image_path) as img:
+            image_w, image_h = img.size
+        scale = min(target_width / image_w, target_height / image_h)
+        return min(zoom_factor, max(1.0, 1.0 / scale))
+
+    def _create_canvas(self, image_path, target_width, target_height, canvas_scale=1.0):
+        """将图片按比例缩放后居中放置在黑色画布上（画布为输出分辨率乘以canvas_scale）"""
+        canvas_w = int(round(target_width * canvas_scale))
+        canvas_h = int(round(target_height * canvas_scale))
         
-        # 如果需要，添加黑边使其符合目标尺寸
-        if new_width != target_width or new_height != target_height:
-            from moviepy.editor import ColorClip, CompositeVideoClip
+        with Image.open(image_path) as img:
+            img = img.convert("RGB")
             
-            # 创建黑色背景
-            background = ColorClip(
-                size=(target_width, target_height), 
-                color=(0, 0, 0)
-            ).set_duration(clip.duration)
-            
-            # 将调整后的图片居中放置在背景上
-            resized_clip = resized_clip.set_position("center")
-            
-            # 合成最终剪辑
-            return CompositeVideoClip([background, resized_clip])
+            # 选择较小的缩放比例以保持宽高比
+            scale = min(canvas_w / img.width, canvas_h / img.height)
+            new_width = max(1, int(img.width * scale))
+            new_height = max(1, int(img.height * scale))
+            resized = img.resize((new_width, new_height), Image.LANCZOS)
         
-        return resized_clip
-
-    def _apply_zoom_effect(self, clip, zoom_factor, duration):
-        """应用缩放效果"""
+        if (new_width, new_height) == (canvas_w, canvas_h):
+            return resized
         
-        def zoom_function(t):
-            # 计算当前时间的缩放比例
-            # 从1.0开始，逐渐缩放到zoom_factor
-            progress = t / duration
-            current_zoom = 1.0 + (zoom_factor - 1.0) * progress
-            return current_zoom
+        # 添加黑边使其符合目标尺寸
+        canvas = Image.new("RGB", (canvas_w, canvas_h), (0, 0, 0))
+        canvas.paste(resized, ((canvas_w - new_width) // 2, (canvas_h - new_height) // 2))
+        resized.close()
+        return canvas
+
+    def _get_zoom_boxes(self, frame_count, fps, duration, zoom_factor, canvas_w, canvas_h):
+        """
+        预先计算每一帧在画布上的裁剪区域 (left, top, right, bottom)
+        缩放比例从1.0线性增加到zoom_factor，裁剪区域以画布中心为中心逐渐缩小
+        """
+        t = np.arange(frame_count, dtype=np.float64) / fps
+        progress = np.clip(t / duration, 0.0, 1.0)
+        zoom = 1.0 + (zoom_factor - 1.0) * progress
         
-        # 应用动态缩放
-        zoomed_clip = clip.resize(zoom_function)
+        crop_w = canvas_w / zoom
+        crop_h = canvas_h / zoom
+        left = (canvas_w - crop_w) / 2
+        top = (canvas_h - crop_h) / 2
         
-        return zoomed_clip
+        return np.stack([left, top, left + crop_w, top + crop_h], axis=1)
 
 # 节点注册
 NODE_CLASS_MAPPINGS = {
@@ -0,0 +1,86 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+
+class JobJournal:
+    """
+    任务日志 - 记录长任务中已完成的切片，用于中断后继续
+    日志目录位于临时工作空间中，以输入指纹命名：相同的输入再次运行时打开同一个日志，
+    已完成且文件和源视频都未变化的切片直接复用；任务成功后删除日志目录
+    """
+
+    JOURNAL_FILE = "journal.jsonl"
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._path = os.path.join(directory, self.JOURNAL_FILE)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts):
+        """根据任务输入生成日志键"""
+        raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def load(self):
+        """读取已完成的切片：job_id -> 记录，文件缺失、大小不符或源视频已修改的记录会被忽略"""
+        entries = {}
+        try:
+            with open(self._path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError:
+            return entries
+
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # 崩溃时最后一行可能不完整
+                continue
+            try:
+                if os.path.getsize(entry['file_path']) != entry['size']:
+                    continue
+                stat = os.stat(entry['source_path'])
+                if [stat.st_size, stat.st_mtime_ns] != entry['source_fingerprint']:
+                    continue
+            except (OSError, KeyError):
+                continue
+            entries[entry['job_id']] = entry
+        return entries
+
+    def record(self, job_id, source_path, result):
+        """记录一个已完成的切片，立即写入磁盘"""
+        try:
+            stat = os.stat(source_path)
+            entry = {
+                'job_id': job_id,
+                'file_path': result['file_path'],
+                'size': os.path.getsize(result['file_path']),
+                'duration': result['duration'],
+                'cache_key': result.get('cache_key'),
+                'source_path': source_path,
+                'source_fingerprint': [stat.st_size, stat.st_mtime_ns],
+            }
+        except OSError as e:
+            print(f"写入任务日志失败: {str(e)}")
+            return
+
+        with self._lock:
+            with open(self._path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def complete(self):
+        """任务完成，删除日志和其中的切片文件（只能由持有日志的任务调用）"""
+        # 先把目录移走再删除，删除过程中相同任务键的新任务可以立即创建新日志
+        removing = f"{self.directory}.removing.{os.getpid()}.{threading.get_ident()}"
+        try:
+            os.replace(self.directory, removing)
+        except OSError:
+            removing = self.directory
+        shutil.rmtree(removing, ignore_errors=True)
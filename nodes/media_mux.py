@@ -0,0 +1,45 @@
+import os
+from .media_probe import get_media_probe
+
+# 各输出容器可以直接流复制封装的音频编码
+CONTAINER_AUDIO_CODECS = {
+    '.mp4': {'aac', 'mp3', 'ac3', 'eac3', 'alac'},
+    '.m4v': {'aac', 'mp3', 'ac3', 'eac3', 'alac'},
+    '.mov': {'aac', 'mp3', 'ac3', 'eac3', 'alac', 'pcm_s16le', 'pcm_s24le'},
+    '.mkv': {'aac', 'mp3', 'ac3', 'eac3', 'alac', 'opus', 'vorbis', 'flac', 'pcm_s16le', 'pcm_s24le'},
+    '.webm': {'opus', 'vorbis'},
+    '.avi': {'mp3', 'ac3', 'pcm_s16le'},
+}
+
+# 低于该采样率的音频仍然重新编码，保证输出音质
+MIN_PASSTHROUGH_SAMPLE_RATE = 32000
+
+# 需要重新编码时使用的音频参数
+AUDIO_ENCODE_ARGS = ['-c:a', 'aac', '-b:a', '192k']
+
+
+def can_copy_audio(audio_path, output_path):
+    """判断音频流能否不经重新编码直接封装到输出容器"""
+    allowed = CONTAINER_AUDIO_CODECS.get(os.path.splitext(output_path)[1].lower())
+    if not allowed:
+        return False
+    try:
+        stream = get_media_probe().get_stream(audio_path, 'audio')
+    except Exception as e:
+        print(f"获取音频流信息失败 {audio_path}: {str(e)}")
+        return False
+    if stream is None or stream.get('codec_name') not in allowed:
+        return False
+    try:
+        return int(stream.get('sample_rate') or 0) >= MIN_PASSTHROUGH_SAMPLE_RATE
+    except ValueError:
+        return False
+
+
+def get_audio_codec_args(audio_path, output_path, filtered=False):
+    """生成封装音频使用的编码参数：音频经过滤镜（音量、混音等）时必须重新编码，
+    否则编码格式与输出容器兼容时直接流复制"""
+    if not filtered and can_copy_audio(audio_path, output_path):
+        print(f"音频流与输出容器兼容，直接复制: {os.path.basename(audio_path)}")
+        return ['-c:a', 'copy']
+    return list(AUDIO_ENCODE_ARGS)
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import subprocess
+from collections import OrderedDict
+from .toolchain import get_toolchain
+
+# 探测数据格式版本，增加探测字段（如extradata_hash）后旧的缓存数据需要重新探测（关键帧列表仍然有效）
+PROBE_VERSION = 2
+PROBE_VERSION_KEY = "toolbox_probe_version"
+
+
+def get_cache_dir():
+    """获取工具箱缓存目录，可通过环境变量 TOOLBOX_CACHE_DIR 自定义"""
+    cache_dir = os.environ.get("TOOLBOX_CACHE_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cache", "comfyui_toolbox"
+    )
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def parse_frame_rate(rate, default=30.0):
+    """解析ffprobe的帧率字符串（如 30000/1001）"""
+    try:
+        if isinstance(rate, str) and '/' in rate:
+            numerator, denominator = rate.split('/', 1)
+            denominator = float(denominator)
+            return float(numerator) / denominator if denominator else default
+        value = float(rate)
+        return value if value > 0 else default
+    except (TypeError, ValueError):
+        return default
+
+
+class MediaProbe:
+    """
+    媒体探测服务 - 所有视频/音频节点共用
+    缓存完整的ffprobe JSON（format、streams，可选关键帧列表）
+    以 路径+文件大小+修改时间 作为缓存键，结果保存在本地SQLite中并按LRU淘汰
+    临时切片等一次性的中间文件使用 persist=False 探测，只缓存在内存中，不挤占素材库的持久缓存
+    """
+
+    def __init__(self, db_path=None, max_entries=20000, memory_entries=1024):
+        self.db_path = db_path or os.path.join(get_cache_dir(), "media_probe.sqlite")
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._conn = None
+        self._db_disabled = False
+        self._writes_since_evict = 0
+
+    def _connect(self):
+        """打开SQLite连接，失败时退化为仅内存缓存"""
+        if self._conn is not None or self._db_disabled:
+            return self._conn
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS probes ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                "data TEXT, keyframes TEXT, last_access REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_probes_last_access ON probes(last_access)")
+            conn.commit()
+            self._conn = conn
+        except sqlite3.Error as e:
+            print(f"媒体探测缓存不可用，仅使用内存缓存: {str(e)}")
+            self._db_disabled = True
+        return self._conn
+
+    def fingerprint(self, media_path):
+        """返回 (绝对路径, 文件大小, 修改时间ns)，文件不存在时返回None"""
+        try:
+            path = os.path.abspath(media_path)
+            stat = os.stat(path)
+            return path, stat.st_size, stat.st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self, key, persist=True):
+        """从内存或SQLite读取缓存条目"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+
+            if not persist:
+                return None
+            conn = self._connect()
+            if conn is None:
+                return None
+            try:
+                row = conn.execute(
+                    "SELECT data, keyframes FROM probes WHERE path = ? AND size = ? AND mtime_ns = ?",
+                    key
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute("UPDATE probes SET last_access = ? WHERE path = ?", (time.time(), key[0]))
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"读取媒体探测缓存失败: {str(e)}")
+                return None
+
+            entry = {
+                'data': json.loads(row[0]),
+                'keyframes': json.loads(row[1]) if row[1] else None
+            }
+            self._remember(key, entry)
+            return entry
+
+    def _store(self, key, entry, persist=True):
+        """写入内存和SQLite缓存（persist为False时只写入内存）"""
+        with self._lock:
+            self._remember(key, entry)
+
+            if not persist:
+                return
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO probes (path, size, mtime_ns, data, keyframes, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    key + (
+                        json.dumps(entry['data']),
+                        json.dumps(entry['keyframes']) if entry['keyframes'] is not None else None,
+                        time.time()
+                    )
+                )
+                self._writes_since_evict += 1
+                if self._writes_since_evict >= 100:
+                    self._evict(conn)
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"写入媒体探测缓存失败: {str(e)}")
+
+    def _remember(self, key, entry):
+        """更新内存LRU缓存"""
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, conn):
+        """按最近访问时间淘汰超出上限的条目"""
+        self._writes_since_evict = 0
+        count = conn.execute("SELECT COUNT(*) FROM probes").fetchone()[0]
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM probes WHERE path IN "
+                "(SELECT path FROM probes ORDER BY last_access ASC LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def _run_ffprobe(self, media_path):
+        """执行ffprobe获取完整的format和streams信息（包含编码器参数集的哈希 extradata_hash）"""
+        toolchain = get_toolchain()
+        cmd = [toolchain.ffprobe, '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams']
+        if toolchain.supports('data_hash'):
+            cmd.extend(['-show_data_hash', 'CRC32'])
+        cmd.append(media_path)
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffprobe失败: {result.stderr}")
+        data = json.loads(result.stdout)
+        data[PROBE_VERSION_KEY] = PROBE_VERSION
+        return data
+
+    def _is_current(self, entry):
+        """缓存条目的探测数据是否为当前格式"""
+        return entry is not None and entry['data'].get(PROBE_VERSION_KEY) == PROBE_VERSION
+
+    def _run_keyframe_probe(self, media_path):
+        """通过数据包标记获取视频关键帧时间点（相对文件起始时间）"""
+        cmd = [
+            get_toolchain().ffprobe, '-v', 'quiet', '-print_format', 'json',
+            '-select_streams', 'v:0',
+            '-show_entries', 'packet=pts_time,flags:format=start_time',
+            media_path
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffprobe失败: {result.stderr}")
+
+        data = json.loads(result.stdout)
+        start_offset = float(data.get('format', {}).get('start_time', 0) or 0)
+
+        keyframes = []
+        for packet in data.get('packets', []):
+            pts_time = packet.get('pts_time')
+            if 'K' in packet.get('flags', '') and pts_time not in (None, 'N/A'):
+                keyframes.append(float(pts_time) - start_offset)
+
+        keyframes.sort()
+        return keyframes
+
+    def probe(self, media_path, persist=True):
+        """获取完整的ffprobe JSON，失败时抛出异常；persist为False时结果不写入SQLite"""
+        key = self.fingerprint(media_path)
+        if key is None:
+            # 无法获取文件状态（例如URL），不缓存
+            return self._run_ffprobe(media_path)
+
+        entry = self._load(key, persist)
+        if self._is_current(entry):
+            return entry['data']
+
+        data = self._run_ffprobe(media_path)
+        self._store(key, {'data': data, 'keyframes': entry['keyframes'] if entry else None}, persist)
+        return data
+
+    def get_keyframes(self, media_path):
+        """获取视频关键帧时间列表，结果与探测数据一起缓存"""
+        key = self.fingerprint(media_path)
+        if key is None:
+            return self._run_keyframe_probe(media_path)
+
+        entry = self._load(key)
+        if entry is not None and entry['keyframes'] is not None:
+            return entry['keyframes']
+
+        data = entry['data'] if self._is_current(entry) else self._run_ffprobe(media_path)
+        keyframes = self._run_keyframe_probe(media_path)
+        self._store(key, {'data': data, 'keyframes': keyframes})
+        return keyframes
+
+    def get_duration(self, media_path, persist=True):
+        """获取媒体时长（秒），失败时抛出异常"""
+        data = self.probe(media_path, persist)
+        return float(data['format']['duration'])
+
+    def get_stream(self, media_path, codec_type, persist=True):
+        """获取第一个指定类型（video/audio）的流，不存在时返回None"""
+        data = self.probe(media_path, persist)
+        for stream in data.get('streams', []):
+            if stream.get('codec_type') == codec_type:
+                return stream
+        return None
+
+    def has_stream(self, media_path, codec_type):
+        """检查媒体文件是否包含指定类型的流"""
+        return self.get_stream(media_path, codec_type) is not None
+
+
+_media_probe = None
+_media_probe_lock = threading.Lock()
+
+
+def get_media_probe():
+    """获取进程内共享的媒体探测服务"""
+    global _media_probe
+    with _media_probe_lock:
+        if _media_probe is None:
+            _media_probe = MediaProbe()
+        return _media_probe
@@ -1,6 +1,5 @@
 import os
 import json
-import requests
 import io
 import base64
 import numpy as np
@@ -43,6 +42,9 @@ class CreateImageNode:
     def generate_image(self, api_key, prompt, model="gpt-image-1", size="1024x1024", quality="auto", style="vivid", 
                       background="auto", moderation="auto", response_format="b64_json", output_format="png", 
                       output_compression=100, n=1, user="", seed=-1):
+        # requests在首次执行时再导入，不影响ComfyUI启动
+        import requests
+        
         print(f"got prompt: {prompt}")
         # 验证输入参数
         if not api_key:
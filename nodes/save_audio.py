@@ -1,13 +1,10 @@
 import os
 import numpy as np
-import soundfile as sf
-from scipy.io import wavfile
 import folder_paths
 import json
 import torch
 import tempfile
 import shutil
-from pydub import AudioSegment
 
 class SaveAudioNode:
     @classmethod
@@ -26,6 +23,10 @@ class SaveAudioNode:
     CATEGORY = "ToolBox/Audio"
 
     def save_audio(self, audio, filename_prefix, quality="V0"):
+        # scipy和pydub导入较慢，在首次执行时再导入，不影响ComfyUI启动
+        from scipy.io import wavfile
+        from pydub import AudioSegment
+        
         # 获取输出目录
         output_dir = folder_paths.get_output_directory()
         
@@ -0,0 +1,278 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from .job_journal import JobJournal
+
+
+class ScratchSpace:
+    """
+    临时工作空间管理 - 所有节点共用
+    优先使用本地磁盘或tmpfs上的临时目录（可通过 TOOLBOX_SCRATCH_DIR 指定），
+    为每个任务分配互不冲突的工作目录，限制总占用空间，
+    启动时清理崩溃遗留的目录，并把最终结果原子地移动到输出目录。
+    """
+
+    OWNER_FILE = ".owner"
+    # 没有属主信息的目录超过该时间（秒）视为遗留目录
+    ORPHAN_AGE = 24 * 3600
+    # 未完成任务的日志保留时间（秒），超过后不再用于继续任务
+    JOURNAL_MAX_AGE = 7 * 24 * 3600
+
+    def __init__(self, root=None, quota_bytes=None):
+        base_dir = root or os.environ.get("TOOLBOX_SCRATCH_DIR") or tempfile.gettempdir()
+        self.root = os.path.join(os.path.abspath(base_dir), "comfyui_toolbox_scratch")
+        self.jobs_root = os.path.join(self.root, "jobs")
+        self.journals_root = os.path.join(self.root, "journals")
+        os.makedirs(self.jobs_root, exist_ok=True)
+        os.makedirs(self.journals_root, exist_ok=True)
+
+        if quota_bytes is None:
+            quota_gb = float(os.environ.get("TOOLBOX_SCRATCH_QUOTA_GB", "50"))
+            quota_bytes = int(quota_gb * 1024 ** 3)
+        self.quota_bytes = quota_bytes
+        self._lock = threading.Lock()
+
+    def _is_process_alive(self, pid):
+        """检查进程是否仍在运行"""
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        except OSError:
+            return False
+        return True
+
+    def _is_owner_alive(self, owner_file):
+        """属主文件记录的进程是否仍在运行（属主是当前进程时视为正在使用）"""
+        try:
+            with open(owner_file, 'r', encoding='utf-8') as f:
+                pid = int(f.read().strip())
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError):
+            # 属主文件可能刚创建还没写入进程号
+            try:
+                return time.time() - os.path.getmtime(owner_file) < 60
+            except OSError:
+                return False
+        return pid == os.getpid() or self._is_process_alive(pid)
+
+    def _acquire_owner(self, directory):
+        """在目录中独占地创建属主文件，目录已被其他运行中的任务占用时返回False"""
+        owner_file = os.path.join(directory, self.OWNER_FILE)
+        for _ in range(2):
+            try:
+                fd = os.open(owner_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self._is_owner_alive(owner_file):
+                    return False
+                # 属主进程已退出，接管目录
+                try:
+                    os.remove(owner_file)
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(str(os.getpid()))
+            return True
+        return False
+
+    def cleanup_orphans(self):
+        """清理属主进程已退出的任务目录和过期的任务日志（插件加载时调用一次）"""
+        removed = 0
+        try:
+            entries = list(os.scandir(self.jobs_root))
+        except OSError as e:
+            print(f"扫描临时工作空间失败: {str(e)}")
+            return
+
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            owner_file = os.path.join(entry.path, self.OWNER_FILE)
+            try:
+                with open(owner_file, 'r', encoding='utf-8') as f:
+                    pid = int(f.read().strip() or 0)
+                orphaned = pid != os.getpid() and not self._is_process_alive(pid)
+            except (OSError, ValueError):
+                try:
+                    orphaned = time.time() - entry.stat().st_mtime > self.ORPHAN_AGE
+                except OSError:
+                    orphaned = False
+
+            if orphaned:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+
+        # 清理长时间没有继续的任务日志
+        try:
+            for entry in os.scandir(self.journals_root):
+                if not entry.is_dir() or time.time() - entry.stat().st_mtime <= self.JOURNAL_MAX_AGE:
+                    continue
+                if not self._is_owner_alive(os.path.join(entry.path, self.OWNER_FILE)):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    removed += 1
+        except OSError as e:
+            print(f"扫描任务日志失败: {str(e)}")
+
+        if removed:
+            print(f"已清理 {removed} 个遗留的临时工作目录")
+
+    def _directory_size(self, root):
+        """统计目录下所有文件的字节数"""
+        total = 0
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, filename))
+                except OSError:
+                    pass
+        return total
+
+    def usage(self):
+        """统计任务目录和任务日志当前占用的字节数"""
+        return self._directory_size(self.jobs_root) + self._directory_size(self.journals_root)
+
+    def _reclaim_journals(self, needed_bytes):
+        """空间不足时从最久未使用的开始删除没有运行中任务的日志，返回释放的字节数
+
+        这些日志只用于中断后继续任务，删除后相同输入的任务会重新切片
+        """
+        candidates = []
+        try:
+            for entry in os.scandir(self.journals_root):
+                if entry.is_dir() and not self._is_owner_alive(os.path.join(entry.path, self.OWNER_FILE)):
+                    candidates.append((entry.stat().st_mtime, entry.path))
+        except OSError as e:
+            print(f"扫描任务日志失败: {str(e)}")
+            return 0
+
+        freed = 0
+        removed = 0
+        for _, path in sorted(candidates):
+            if freed >= needed_bytes:
+                break
+            freed += self._directory_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+        if removed:
+            print(f"临时空间不足，已删除 {removed} 个未继续的任务日志，释放 {freed / 1024 ** 3:.2f}GB")
+        return freed
+
+    def ensure_space(self, required_bytes):
+        """检查配额和磁盘剩余空间是否足够，不足时先删除未继续的任务日志，仍不足时抛出异常
+
+        这是开始任务前按预估大小做的检查，不是硬性限制：任务运行中实际写入超过预估时不会被中止
+        """
+        with self._lock:
+            used = self.usage()
+            free = shutil.disk_usage(self.jobs_root).free
+            shortfall = max(used + required_bytes - self.quota_bytes, required_bytes - free)
+            if shortfall > 0:
+                freed = self._reclaim_journals(shortfall)
+                used -= freed
+                free += freed
+            if used + required_bytes > self.quota_bytes:
+                raise RuntimeError(
+                    f"临时空间配额不足: 已使用 {used / 1024 ** 3:.2f}GB，"
+                    f"需要 {required_bytes / 1024 ** 3:.2f}GB，配额 {self.quota_bytes / 1024 ** 3:.2f}GB"
+                )
+            if required_bytes > free:
+                raise RuntimeError(
+                    f"临时目录磁盘空间不足: 剩余 {free / 1024 ** 3:.2f}GB，需要 {required_bytes / 1024 ** 3:.2f}GB"
+                )
+
+    def create_job_dir(self, prefix="job"):
+        """创建不会冲突的任务目录并记录属主进程"""
+        job_dir = tempfile.mkdtemp(prefix=f"{prefix}_", dir=self.jobs_root)
+        with open(os.path.join(job_dir, self.OWNER_FILE), 'w', encoding='utf-8') as f:
+            f.write(str(os.getpid()))
+        return job_dir
+
+    @contextmanager
+    def job_dir(self, prefix="job", reserve_bytes=0):
+        """任务工作目录上下文，退出时自动删除"""
+        if reserve_bytes > 0:
+            self.ensure_space(reserve_bytes)
+        job_dir = self.create_job_dir(prefix)
+        try:
+            yield job_dir
+        finally:
+            self.remove_job_dir(job_dir)
+
+    def remove_job_dir(self, job_dir):
+        """删除任务目录"""
+        try:
+            if os.path.exists(job_dir):
+                shutil.rmtree(job_dir)
+                print(f"已清理临时目录: {job_dir}")
+        except Exception as e:
+            print(f"清理临时目录失败: {str(e)}")
+
+    def open_journal(self, job_key):
+        """打开（或创建）指定任务键的任务日志并独占使用
+
+        相同输入的任务可能同时运行（例如同一批素材配不同的音频），它们会得到相同的任务键；
+        日志已被其他运行中的任务占用时返回None，调用方改用自己的任务目录，用完后调用 release_journal()
+        """
+        directory = os.path.join(self.journals_root, job_key)
+        # 与 ensure_space() 互斥，避免刚创建的日志目录被当作未继续的日志删除
+        with self._lock:
+            os.makedirs(directory, exist_ok=True)
+            if not self._acquire_owner(directory):
+                return None
+        journal = JobJournal(directory)
+        # 刷新修改时间，避免正在使用的日志被当作过期日志清理
+        os.utime(journal.directory, None)
+        return journal
+
+    def release_journal(self, journal):
+        """释放任务日志的独占，保留已完成的切片供下次继续"""
+        try:
+            os.remove(os.path.join(journal.directory, self.OWNER_FILE))
+        except OSError:
+            pass
+
+    def commit(self, source_path, dest_path, keep_source=False):
+        """把最终结果原子地放到输出路径，跨文件系统时先复制为临时文件再重命名"""
+        dest_dir = os.path.dirname(os.path.abspath(dest_path))
+        os.makedirs(dest_dir, exist_ok=True)
+
+        if not keep_source:
+            try:
+                os.replace(source_path, dest_path)
+                return dest_path
+            except OSError:
+                # 不在同一个文件系统上，改为复制
+                pass
+
+        partial_path = os.path.join(dest_dir, f".{os.path.basename(dest_path)}.{os.getpid()}.part")
+        try:
+            shutil.copy2(source_path, partial_path)
+            os.replace(partial_path, dest_path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+        if not keep_source:
+            os.remove(source_path)
+        return dest_path
+
+
+_scratch_space = None
+_scratch_space_lock = threading.Lock()
+
+
+def get_scratch_space():
+    """获取进程内共享的临时工作空间，首次调用时清理遗留目录（插件加载时即调用）"""
+    global _scratch_space
+    with _scratch_space_lock:
+        if _scratch_space is None:
+            _scratch_space = ScratchSpace()
+            _scratch_space.cleanup_orphans()
+        return _scratch_space
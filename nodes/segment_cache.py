@@ -0,0 +1,110 @@
+import os
+import time
+import shutil
+import hashlib
+import threading
+from .media_probe import get_media_probe
+from .scratch_space import get_scratch_space
+
+
+class SegmentCache:
+    """
+    片段缓存 - 按内容寻址保存归一化后的视频片段
+    缓存键由 源文件指纹、起始时间、时长、目标分辨率、质量预设 组成，
+    多次运行使用相同素材时可以直接复用已切好的片段。
+    缓存位于临时工作空间中，有容量上限，超出时按最近使用时间（文件mtime）淘汰。
+    """
+
+    # 刚刚写入或命中的片段不会被淘汰，避免删除其他并发任务刚查到、还没打开的文件；
+    # 当前任务用到的片段由 evict(protect=...) 保护，这里只需要很短的时间
+    MIN_EVICT_AGE = 60
+
+    def __init__(self, max_bytes, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir or os.environ.get("TOOLBOX_SEGMENT_CACHE_DIR") or os.path.join(
+            get_scratch_space().root, "segment_cache"
+        )
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def make_key(self, source_path, start_time, duration, width, height, preset, extension=".mp4"):
+        """生成片段缓存键，源文件无法访问时返回None"""
+        fingerprint = get_media_probe().fingerprint(source_path)
+        if fingerprint is None:
+            return None
+        raw = "|".join([
+            fingerprint[0], str(fingerprint[1]), str(fingerprint[2]),
+            f"{start_time:.3f}", f"{duration:.3f}", str(width), str(height), str(preset)
+        ])
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest() + extension
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def lookup(self, key):
+        """查找缓存片段，命中时刷新其使用时间并返回路径"""
+        if not key:
+            return None
+        path = self._path(key)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def store(self, key, file_path):
+        """把切好的片段移入缓存，返回缓存中的路径"""
+        if not key:
+            return file_path
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            # 先写入临时文件再原子替换，避免并发任务读到不完整的片段
+            shutil.move(file_path, temp_path)
+            os.replace(temp_path, path)
+            return path
+        except OSError as e:
+            print(f"写入片段缓存失败: {str(e)}")
+            if os.path.exists(temp_path) and not os.path.exists(file_path):
+                shutil.move(temp_path, file_path)
+            return file_path
+
+    def evict(self, protect=()):
+        """按LRU淘汰片段，直到缓存总大小不超过上限"""
+        protected = {self._path(key) for key in protect if key}
+        with self._lock:
+            entries = []
+            total_size = 0
+            try:
+                with os.scandir(self.cache_dir) as iterator:
+                    for entry in iterator:
+                        if not entry.is_file() or entry.name.endswith(".part"):
+                            continue
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                        total_size += stat.st_size
+            except OSError as e:
+                print(f"扫描片段缓存失败: {str(e)}")
+                return
+
+            if total_size <= self.max_bytes:
+                return
+
+            now = time.time()
+            removed = 0
+            for mtime, size, path in sorted(entries):
+                if total_size <= self.max_bytes:
+                    break
+                if path in protected or now - mtime < self.MIN_EVICT_AGE:
+                    continue
+                try:
+                    os.remove(path)
+                    total_size -= size
+                    removed += 1
+                except OSError:
+                    pass
+
+            if removed:
+                print(f"片段缓存已淘汰 {removed} 个文件，当前大小: {total_size / (1024 ** 3):.2f}GB")
+            if total_size > self.max_bytes:
+                print(f"片段缓存仍超出上限 {self.max_bytes / (1024 ** 3):.2f}GB（剩余文件正在被当前任务使用）")
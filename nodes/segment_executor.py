@@ -0,0 +1,418 @@
+import os
+import hmac
+import json
+import time
+import queue
+import ipaddress
+import threading
+import subprocess
+from collections import deque
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .ffmpeg_runner import run_ffmpeg, check_interrupted, ProcessingInterrupted
+
+# 命令中输入/输出文件的占位符，远程工作进程替换为自己的路径
+INPUT_PLACEHOLDER = "{input}"
+OUTPUT_PLACEHOLDER = "{output}"
+
+
+def run_job_command(job, input_path, output_path, cancel_event=None):
+    """执行切片任务的FFmpeg命令，返回 (是否成功, 错误信息)，用户中断或cancel_event被设置时抛出中断异常"""
+    cmd = [
+        input_path if arg == INPUT_PLACEHOLDER else output_path if arg == OUTPUT_PLACEHOLDER else arg
+        for arg in job['cmd']
+    ]
+    try:
+        # 并行切片时由调用方按完成的任务数显示进度
+        result = run_ffmpeg(cmd, timeout=job.get('timeout', 300), progress=False, cancel_event=cancel_event)
+    except subprocess.TimeoutExpired:
+        return False, "FFmpeg执行超时"
+    except OSError as e:
+        return False, str(e)
+    if result.returncode != 0:
+        return False, result.stderr[-2000:]
+    if not os.path.exists(output_path):
+        return False, "输出文件不存在"
+    return True, ""
+
+
+class LocalSegmentExecutor:
+    """本地执行器 - 在当前进程的线程池中运行切片任务"""
+
+    def __init__(self, workers):
+        self.workers = max(1, workers)
+
+    def run(self, jobs, on_complete):
+        """执行所有任务，每完成一个任务在调用线程中回调 on_complete(job, 是否成功, 错误信息)"""
+        if not jobs:
+            return
+        cancel_event = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            futures = {
+                executor.submit(run_job_command, job, job['input_path'], job['output_path'], cancel_event): job
+                for job in jobs
+            }
+            for future in as_completed(futures):
+                ok, error = future.result()
+                on_complete(futures[future], ok, error)
+        except BaseException:
+            # 中断或出错时结束所有正在运行的FFmpeg，排队的任务不再执行
+            cancel_event.set()
+            raise
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+class _JobBoard:
+    """分布式执行的任务队列：待领取、已租出（带期限）、已完成"""
+
+    def __init__(self, jobs, lease_seconds, max_attempts):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.jobs = {job['job_id']: job for job in jobs}
+        self.pending = deque(job['job_id'] for job in jobs)
+        self.leases = {}
+        self.attempts = {job_id: 0 for job_id in self.jobs}
+        self.finished = set()
+        # 完成事件交给调度线程处理：(job_id, 是否成功, 错误信息)
+        self.events = queue.Queue()
+        self._lock = threading.Lock()
+
+    def lease(self, worker):
+        """领取一个任务，没有待处理任务时返回None"""
+        with self._lock:
+            while self.pending:
+                job_id = self.pending.popleft()
+                if job_id in self.finished:
+                    continue
+                self.attempts[job_id] += 1
+                self.leases[job_id] = (time.time() + self.lease_seconds, worker)
+                return self.jobs[job_id]
+            return None
+
+    def is_active(self, job_id):
+        with self._lock:
+            return job_id in self.jobs and job_id not in self.finished
+
+    def complete(self, job_id):
+        """标记任务成功，重复提交的结果返回False"""
+        with self._lock:
+            if job_id not in self.jobs or job_id in self.finished:
+                return False
+            self.finished.add(job_id)
+            self.leases.pop(job_id, None)
+        self.events.put((job_id, True, ""))
+        return True
+
+    def fail(self, job_id, error):
+        """任务失败：未超过重试次数时重新排队，否则标记为失败"""
+        with self._lock:
+            if job_id not in self.jobs or job_id in self.finished:
+                return
+            self.leases.pop(job_id, None)
+            if self.attempts[job_id] < self.max_attempts:
+                self.pending.append(job_id)
+                return
+            self.finished.add(job_id)
+        self.events.put((job_id, False, error))
+
+    def expire_leases(self):
+        """超过租期没有返回结果的任务视为失败（工作进程可能已退出）"""
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, (deadline, _) in self.leases.items() if deadline < now]
+        for job_id in expired:
+            print(f"切片任务 {job_id} 租期已过，重新分配")
+            self.fail(job_id, "工作进程未在租期内返回结果")
+
+    def done(self):
+        with self._lock:
+            return len(self.finished) == len(self.jobs)
+
+
+class _WorkerRequestHandler(BaseHTTPRequestHandler):
+    """工作进程协议
+
+    GET  /jobs/next?worker=ID        领取任务（204: 暂无任务，410: 已全部完成）
+    GET  /sources/<job_id>           读取任务的源视频（支持Range，FFmpeg可直接按需读取）
+    PUT  /jobs/<job_id>/result       上传切好的片段
+    POST /jobs/<job_id>/failure      报告失败，JSON: {"error": "..."}
+    """
+
+    server_version = "ToolBoxSegmentExecutor/1.0"
+
+    def log_message(self, format, *args):
+        # 不输出每个请求的访问日志
+        pass
+
+    def _authorized(self):
+        token = self.server.token
+        if not token:
+            return True
+        query = parse_qs(urlparse(self.path).query)
+        provided = self.headers.get("X-Toolbox-Token") or query.get("token", [""])[0]
+        return hmac.compare_digest(provided.encode("utf-8"), token.encode("utf-8"))
+
+    def _send(self, status, body=None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        if body is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+    def _route(self):
+        return [part for part in urlparse(self.path).path.split("/") if part]
+
+    def do_GET(self):
+        if not self._authorized():
+            return self._send(403, {"error": "forbidden"})
+        board = self.server.board
+        route = self._route()
+
+        if route == ["jobs", "next"]:
+            if board.done():
+                return self._send(410, {"status": "finished"})
+            worker = parse_qs(urlparse(self.path).query).get("worker", ["unknown"])[0]
+            job = board.lease(worker)
+            if job is None:
+                return self._send(204)
+            return self._send(200, {
+                'job_id': job['job_id'],
+                'cmd': job['cmd'],
+                'timeout': job.get('timeout', 300),
+                'input_path': job['input_path'],
+                'source_url': f"/sources/{job['job_id']}",
+                'lease_seconds': board.lease_seconds,
+            })
+
+        if len(route) == 2 and route[0] == "sources" and route[1] in board.jobs:
+            return self._send_file(board.jobs[route[1]]['input_path'])
+
+        return self._send(404, {"error": "not found"})
+
+    def _send_file(self, path):
+        """发送源视频，支持单个Range请求"""
+        try:
+            size = os.path.getsize(path)
+            f = open(path, 'rb')
+        except OSError:
+            return self._send(404, {"error": "source not found"})
+
+        with f:
+            start, end = 0, size - 1
+            range_header = self.headers.get("Range", "")
+            if range_header.startswith("bytes="):
+                first, _, last = range_header[6:].split(",")[0].partition("-")
+                if first:
+                    start = int(first)
+                    end = int(last) if last else size - 1
+                elif last:
+                    start = max(0, size - int(last))
+                end = min(end, size - 1)
+                if start > end:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            else:
+                self.send_response(200)
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.end_headers()
+
+            f.seek(start)
+            remaining = end - start + 1
+            try:
+                while remaining > 0:
+                    chunk = f.read(min(1024 * 1024, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                # FFmpeg按需读取时会主动断开连接
+                pass
+
+    def do_PUT(self):
+        if not self._authorized():
+            return self._send(403, {"error": "forbidden"})
+        board = self.server.board
+        route = self._route()
+        if len(route) != 3 or route[0] != "jobs" or route[2] != "result" or route[1] not in board.jobs:
+            return self._send(404, {"error": "not found"})
+
+        job_id = route[1]
+        length = int(self.headers.get("Content-Length", 0))
+        if not board.is_active(job_id):
+            # 任务已由其他工作进程完成，丢弃结果
+            self.rfile.read(length)
+            return self._send(200, {"status": "ignored"})
+
+        output_path = board.jobs[job_id]['output_path']
+        partial_path = f"{output_path}.{threading.get_ident()}.part"
+        try:
+            with open(partial_path, 'wb') as f:
+                remaining = length
+                while remaining > 0:
+                    chunk = self.rfile.read(min(1024 * 1024, remaining))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            if remaining:
+                raise IOError("上传数据不完整")
+            if board.is_active(job_id):
+                os.replace(partial_path, output_path)
+                board.complete(job_id)
+        except (OSError, IOError) as e:
+            board.fail(job_id, f"接收切片失败: {str(e)}")
+            return self._send(500, {"error": str(e)})
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        return self._send(200, {"status": "ok"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return self._send(403, {"error": "forbidden"})
+        board = self.server.board
+        route = self._route()
+        if len(route) != 3 or route[0] != "jobs" or route[2] != "failure" or route[1] not in board.jobs:
+            return self._send(404, {"error": "not found"})
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            error = json.loads(self.rfile.read(length) or b"{}").get("error", "")
+        except ValueError:
+            error = ""
+        print(f"工作进程报告切片任务 {route[1]} 失败: {error}")
+        board.fail(route[1], error)
+        return self._send(200, {"status": "ok"})
+
+
+class HttpSegmentExecutor:
+    """
+    分布式执行器 - 通过HTTP任务队列把切片任务分发给工作进程
+    本机仍按线程预算处理任务，其他机器（或本机的其他进程）运行 segment_worker.py 领取任务，
+    源视频通过HTTP按需读取（也可使用共享存储上的相同路径），切好的片段上传回本机
+    """
+
+    def __init__(self, bind="127.0.0.1:8765", local_workers=1, token=None, lease_seconds=600, max_attempts=3):
+        host, _, port = bind.rpartition(":")
+        self.host = host or "127.0.0.1"
+        self.port = int(port)
+        self.local_workers = max(0, local_workers)
+        self.token = token if token is not None else os.environ.get("TOOLBOX_WORKER_TOKEN", "")
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        if not self.token and not self._is_loopback(self.host):
+            # 没有令牌时任何人都可以读取源视频、上传会写入输出的切片
+            raise RuntimeError(
+                f"任务队列监听非本机地址 {self.host} 时必须设置环境变量 TOOLBOX_WORKER_TOKEN（工作进程使用相同的 --token）"
+            )
+
+    @staticmethod
+    def _is_loopback(host):
+        if host == "localhost":
+            return True
+        try:
+            return ipaddress.ip_address(host).is_loopback
+        except ValueError:
+            return False
+
+    def _create_server(self):
+        """启动任务队列HTTP服务，端口被占用（例如另一个渲染正在使用）时改用系统分配的端口"""
+        try:
+            return ThreadingHTTPServer((self.host, self.port), _WorkerRequestHandler)
+        except OSError as e:
+            if self.port == 0:
+                raise
+            print(f"警告: 任务队列端口 {self.port} 不可用（{str(e)}），改用系统分配的端口，远程工作进程需要使用下面显示的地址")
+            return ThreadingHTTPServer((self.host, 0), _WorkerRequestHandler)
+
+    def _local_worker(self, board, stop_event, cancel_event):
+        """本机工作线程，直接从任务队列领取任务"""
+        worker = f"local-{threading.get_ident()}"
+        while not stop_event.is_set():
+            job = board.lease(worker)
+            if job is None:
+                if board.done():
+                    return
+                stop_event.wait(0.2)
+                continue
+            partial_path = f"{job['output_path']}.local.mp4"
+            try:
+                ok, error = run_job_command(job, job['input_path'], partial_path, cancel_event)
+            except ProcessingInterrupted:
+                # 通知调度线程结束任务（同时结束其他本机线程的FFmpeg）
+                cancel_event.set()
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+                return
+            if ok and board.is_active(job['job_id']):
+                os.replace(partial_path, job['output_path'])
+                board.complete(job['job_id'])
+            elif not ok:
+                board.fail(job['job_id'], error)
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    def run(self, jobs, on_complete):
+        """分发所有任务并等待完成，每完成一个任务在调用线程中回调 on_complete(job, 是否成功, 错误信息)"""
+        if not jobs:
+            return
+
+        board = _JobBoard(jobs, self.lease_seconds, self.max_attempts)
+        server = self._create_server()
+        server.daemon_threads = True
+        server.board = board
+        server.token = self.token
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        print(f"分布式切片: 任务队列 http://{self.host}:{server.server_address[1]}，{len(jobs)} 个任务，本机 {self.local_workers} 个工作线程")
+
+        stop_event = threading.Event()
+        cancel_event = threading.Event()
+        local_threads = [
+            threading.Thread(target=self._local_worker, args=(board, stop_event, cancel_event), daemon=True)
+            for _ in range(self.local_workers)
+        ]
+        for thread in local_threads:
+            thread.start()
+
+        try:
+            completed = 0
+            while completed < len(jobs):
+                check_interrupted(cancel_event)
+                try:
+                    job_id, ok, error = board.events.get(timeout=0.25)
+                except queue.Empty:
+                    board.expire_leases()
+                    continue
+                completed += 1
+                on_complete(board.jobs[job_id], ok, error)
+        finally:
+            # 结束本机仍在运行的FFmpeg（中断，或任务已由其他工作进程完成）
+            cancel_event.set()
+            stop_event.set()
+            # 让仍在轮询的工作进程收到410后退出
+            time.sleep(0.5)
+            server.shutdown()
+            server.server_close()
+            for thread in local_threads:
+                thread.join(timeout=1.0)
+
+
+def create_segment_executor(mode, workers, bind="127.0.0.1:8765"):
+    """根据执行模式创建切片执行器"""
+    if mode == "http":
+        return HttpSegmentExecutor(bind=bind, local_workers=workers)
+    return LocalSegmentExecutor(workers)
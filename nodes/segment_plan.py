@@ -0,0 +1,174 @@
+from array import array
+from bisect import bisect_right
+
+
+class SegmentPlan:
+    """
+    紧凑的切片计划 - 用数组按列保存片段
+    源视频路径和探测信息只保存一份，片段只记录源视频编号、起止时间和是否可流复制；
+    按索引访问时才临时生成片段字典，兼容原有的字典式访问
+    """
+
+    __slots__ = ('sources', '_source_index', '_start', '_end', '_stream_copy')
+
+    def __init__(self):
+        self.sources = []
+        self._source_index = array('I')
+        self._start = array('d')
+        self._end = array('d')
+        self._stream_copy = bytearray()
+
+    def add_source(self, source_path, source_info):
+        """登记源视频，返回源视频编号"""
+        self.sources.append((source_path, source_info))
+        return len(self.sources) - 1
+
+    def append(self, source_index, start_time, end_time, stream_copy=False):
+        """添加一个片段"""
+        self._source_index.append(source_index)
+        self._start.append(start_time)
+        self._end.append(end_time)
+        self._stream_copy.append(1 if stream_copy else 0)
+
+    def __len__(self):
+        return len(self._start)
+
+    def __getitem__(self, index):
+        source_path, source_info = self.sources[self._source_index[index]]
+        start_time = self._start[index]
+        end_time = self._end[index]
+        return {
+            'source_path': source_path,
+            'start_time': start_time,
+            'end_time': end_time,
+            'duration': end_time - start_time,
+            'source_info': source_info,
+            'stream_copy': bool(self._stream_copy[index])
+        }
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def duration(self, index):
+        """片段时长，不生成片段字典"""
+        return self._end[index] - self._start[index]
+
+    def source_index(self, index):
+        """片段所属源视频的编号"""
+        return self._source_index[index]
+
+
+class FittedTimeline:
+    """
+    按音频长度填充后的时间线 - 完整循环次数 + 最后一轮的前缀 + 可选的截短片段
+    只保存参与循环的片段顺序，迭代时才逐个生成 (片段索引, 使用时长)
+    """
+
+    __slots__ = ('order', 'durations', 'cycles', 'prefix_count', 'tail', 'total_duration')
+
+    def __init__(self, order, durations, cycles, prefix_count, tail, total_duration):
+        self.order = order
+        self.durations = durations
+        self.cycles = cycles
+        self.prefix_count = prefix_count
+        self.tail = tail
+        self.total_duration = total_duration
+
+    def __len__(self):
+        return self.cycles * len(self.order) + self.prefix_count + (1 if self.tail else 0)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        for _ in range(self.cycles):
+            for position, index in enumerate(self.order):
+                yield index, self.durations[position]
+        for position in range(self.prefix_count):
+            yield self.order[position], self.durations[position]
+        if self.tail:
+            yield self.tail
+
+    def distinct(self):
+        """时间线上出现过的不重复条目，数量不超过片段数+1"""
+        count = len(self.order) if self.cycles else self.prefix_count
+        for position in range(count):
+            yield self.order[position], self.durations[position]
+        if self.tail:
+            yield self.tail
+
+
+def fit_timeline(plan, order, audio_duration, overlap=0, min_tail=0.5):
+    """用算术方式在片段计划上填充音频长度：先计算完整循环次数，再在最后一轮中二分定位
+
+    overlap为相邻片段交叉过渡的重叠时长，除第一个片段外每个片段的有效时长都会减去重叠部分；
+    最后一个片段被截短，剩余时长不足min_tail时丢弃
+    """
+    durations = array('d', (plan.duration(index) for index in order))
+    if not order or audio_duration <= 0:
+        return FittedTimeline(order, durations, 0, 0, None, 0.0)
+
+    # 每个片段贡献 (时长 - 重叠) 的有效时长，第一个片段额外贡献一个重叠时长
+    prefix = [0.0]
+    for duration in durations:
+        prefix.append(prefix[-1] + duration - overlap)
+    cycle_length = prefix[-1]
+    target = audio_duration - overlap
+
+    if cycle_length > 0 and target > 0:
+        cycles = int(target // cycle_length)
+        prefix_count = bisect_right(prefix, target - cycles * cycle_length) - 1
+        if prefix_count >= len(order):
+            # 浮点误差导致刚好多出一整轮
+            cycles += 1
+            prefix_count = 0
+    else:
+        cycles, prefix_count = 0, 0
+
+    used = cycles * cycle_length + prefix[prefix_count]
+    placed = cycles * len(order) + prefix_count
+    current = used + overlap if placed else 0.0
+    tail = None
+    if used < target or not placed:
+        # 第一个片段前面没有过渡，之后的截短片段需要额外保留被过渡覆盖的开头
+        remaining = audio_duration - current
+        if remaining > min_tail:
+            tail = (order[prefix_count], remaining + (overlap if placed else 0))
+            current = audio_duration
+    return FittedTimeline(order, durations, cycles, prefix_count, tail, current)
+
+
+class TimelineFiles:
+    """
+    时间线的拼接视图 - 迭代时才把时间线条目逐个解析为 (切片文件路径, 使用时长)
+    只保存时间线和 切片任务键 -> 文件路径 的映射，不为每个条目生成字典；
+    resolve(index, duration) 返回条目对应的切片任务键，映射中没有的条目（切片失败）会被跳过
+    """
+
+    __slots__ = ('timeline', 'files', 'resolve')
+
+    def __init__(self, timeline, files, resolve):
+        self.timeline = timeline
+        self.files = files
+        self.resolve = resolve
+
+    def __iter__(self):
+        for index, duration in self.timeline:
+            file_path = self.files.get(self.resolve(index, duration))
+            if file_path is not None:
+                yield file_path, duration
+
+    def __bool__(self):
+        return next(iter(self), None) is not None
+
+    def distinct_files(self):
+        """时间线用到的不重复文件，数量不超过片段数+1"""
+        for index, duration in self.timeline.distinct():
+            file_path = self.files.get(self.resolve(index, duration))
+            if file_path is not None:
+                yield file_path
+
+    @property
+    def total_duration(self):
+        return self.timeline.total_duration
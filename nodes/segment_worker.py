@@ -0,0 +1,143 @@
+"""
+Smart Video Combiner 分布式切片工作进程（只依赖Python标准库和FFmpeg）
+
+用法:
+    python segment_worker.py --server http://主机:8765 [--token 令牌] [--ffmpeg FFmpeg路径] [--exit-when-idle]
+
+工作进程循环领取切片任务：源视频在本机存在相同路径（共享存储）时直接读取，
+否则通过HTTP按需读取；切好的片段上传回调度端，失败时报告错误由调度端重新分配。
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+import urllib.error
+import urllib.request
+
+INPUT_PLACEHOLDER = "{input}"
+OUTPUT_PLACEHOLDER = "{output}"
+
+
+class SegmentWorker:
+    """分布式切片工作进程"""
+
+    def __init__(self, server, token="", worker_id=None, poll_interval=1.0, ffmpeg="ffmpeg"):
+        self.server = server.rstrip("/")
+        self.token = token
+        self.ffmpeg = ffmpeg
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.poll_interval = poll_interval
+
+    def _request(self, method, path, data=None, headers=None, timeout=60):
+        request = urllib.request.Request(self.server + path, data=data, method=method)
+        if self.token:
+            request.add_header("X-Toolbox-Token", self.token)
+        for name, value in (headers or {}).items():
+            request.add_header(name, value)
+        return urllib.request.urlopen(request, timeout=timeout)
+
+    def fetch_job(self):
+        """领取任务，返回 (状态码, 任务)"""
+        with self._request("GET", f"/jobs/next?worker={self.worker_id}") as response:
+            if response.status == 204:
+                return 204, None
+            return response.status, json.loads(response.read().decode("utf-8"))
+
+    def upload_result(self, job_id, output_path):
+        """上传切好的片段"""
+        size = os.path.getsize(output_path)
+        with open(output_path, 'rb') as f:
+            with self._request("PUT", f"/jobs/{job_id}/result", data=f, timeout=600, headers={
+                "Content-Type": "application/octet-stream",
+                "Content-Length": str(size),
+            }) as response:
+                response.read()
+
+    def report_failure(self, job_id, error):
+        """报告任务失败"""
+        data = json.dumps({"error": error[-2000:]}).encode("utf-8")
+        try:
+            with self._request("POST", f"/jobs/{job_id}/failure", data=data, headers={
+                "Content-Type": "application/json",
+            }) as response:
+                response.read()
+        except (urllib.error.URLError, OSError) as e:
+            print(f"报告失败时出错: {str(e)}")
+
+    def _source_url(self, job):
+        url = self.server + job['source_url']
+        if self.token:
+            url += f"?token={self.token}"
+        return url
+
+    def run_job(self, job):
+        """执行单个切片任务"""
+        # 共享存储上有相同路径时直接读取，否则让FFmpeg通过HTTP按需读取源视频
+        input_path = job['input_path'] if os.path.exists(job['input_path']) else self._source_url(job)
+        with tempfile.TemporaryDirectory(prefix="toolbox_worker_") as temp_dir:
+            output_path = os.path.join(temp_dir, "segment.mp4")
+            # 任务命令中的FFmpeg路径属于调度端，替换为本机的FFmpeg
+            cmd = [self.ffmpeg] + [
+                input_path if arg == INPUT_PLACEHOLDER else output_path if arg == OUTPUT_PLACEHOLDER else arg
+                for arg in job['cmd'][1:]
+            ]
+            print(f"[{self.worker_id}] 切片任务 {job['job_id']}")
+            try:
+                result = subprocess.run(cmd, capture_output=True, text=True, timeout=job.get('timeout', 300))
+                error = result.stderr if result.returncode != 0 else ""
+            except subprocess.TimeoutExpired:
+                error = "FFmpeg执行超时"
+
+            if not error and not os.path.exists(output_path):
+                error = "输出文件不存在"
+            if error:
+                print(f"[{self.worker_id}] 任务 {job['job_id']} 失败")
+                self.report_failure(job['job_id'], error)
+                return
+            self.upload_result(job['job_id'], output_path)
+
+    def run(self, exit_when_idle=False):
+        """循环领取并执行任务"""
+        print(f"工作进程 {self.worker_id} 已启动，调度端: {self.server}")
+        while True:
+            try:
+                status, job = self.fetch_job()
+            except urllib.error.HTTPError as e:
+                if e.code == 410 and exit_when_idle:
+                    print("所有任务已完成，工作进程退出")
+                    return
+                status, job = e.code, None
+            except (urllib.error.URLError, OSError):
+                # 调度端尚未启动或已关闭
+                if exit_when_idle:
+                    return
+                status, job = None, None
+
+            if job is None:
+                time.sleep(self.poll_interval)
+                continue
+            try:
+                self.run_job(job)
+            except (urllib.error.URLError, OSError) as e:
+                print(f"[{self.worker_id}] 任务 {job['job_id']} 出错: {str(e)}")
+                self.report_failure(job['job_id'], str(e))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Smart Video Combiner 分布式切片工作进程")
+    parser.add_argument("--server", required=True, help="调度端地址，例如 http://192.168.1.10:8765")
+    parser.add_argument("--token", default=os.environ.get("TOOLBOX_WORKER_TOKEN", ""), help="访问令牌")
+    parser.add_argument("--worker-id", default=None, help="工作进程名称")
+    parser.add_argument("--ffmpeg", default=os.environ.get("TOOLBOX_FFMPEG", "ffmpeg"), help="FFmpeg可执行文件路径")
+    parser.add_argument("--exit-when-idle", action="store_true", help="任务全部完成或调度端不可用时退出")
+    args = parser.parse_args(argv)
+
+    SegmentWorker(args.server, args.token, args.worker_id, ffmpeg=args.ffmpeg).run(args.exit_when_idle)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,23 @@
 import os
 import random
-import shutil
-import tempfile
 import subprocess
 import folder_paths
 import glob
 import re
-import itertools
-import json
-import gc
+import bisect
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .media_probe import get_media_probe, parse_frame_rate
+from .segment_cache import SegmentCache
+from .directory_index import get_directory_index
+from .scratch_space import get_scratch_space
+from .stream_preflight import plan_normalization, normalize_file, get_stream_signature, diff_signatures
+from .segment_plan import SegmentPlan, TimelineFiles, fit_timeline
+from .edit_decision_list import build_edl
+from .job_journal import JobJournal
+from .segment_executor import create_segment_executor, INPUT_PLACEHOLDER, OUTPUT_PLACEHOLDER
+from .ffmpeg_runner import run_ffmpeg, create_progress_bar, ProcessingInterrupted, concat_file_line
+from .toolchain import get_toolchain
+from .media_mux import get_audio_codec_args
 
 class SmartVideoCombinerNode:
     """
@@ -29,6 +38,19 @@ class SmartVideoCombinerNode:
     - 最小化编码损失，保持最佳画质
     """
     
+    # 单次渲染模式下允许的最大输入数，超过后回退到分段模式以避免同时打开过多解码器
+    # （交叉淡化改为按该数量分批渲染，批次之间再做一次交叉淡化）
+    SINGLE_PASS_MAX_INPUTS = 128
+    # 过渡效果时长（秒），片段较短时自动缩短为片段时长的一半
+    TRANSITION_DURATION = 1.0
+    # 并发探测视频目录时的最大线程数（探测主要受I/O限制）
+    PROBE_WORKERS = 16
+    # 中间片段使用的快速全帧内编码参数，最终输出时再按用户选择的质量编码一次
+    MEZZANINE_PARAMS = ['-preset', 'ultrafast', '-crf', '14', '-g', '1', '-pix_fmt', 'yuv420p']
+    # 草稿模式的编码参数和最大边长
+    DRAFT_PARAMS = ['-preset', 'ultrafast', '-crf', '30']
+    DRAFT_MAX_SIZE = 640
+    
     @classmethod
     def INPUT_TYPES(cls):
         return {
@@ -42,24 +64,36 @@ class SmartVideoCombinerNode:
                 "add_audio_to_video": ("BOOLEAN", {"default": False}),
             },
             "optional": {
-                "transition_mode": (["none", "fade_in", "fade_out", "crossfade"], {"default": "none"}),
+                "transition_mode": (["none", "fade_in", "fade_out", "crossfade"], {"default": "none", "tooltip": "过渡效果；crossfade在单个滤镜图中完成，时间线超过128个片段时分批渲染为中间文件后再编码一次（多一次完整编码，需要额外的临时空间）"}),
                 "video_width": ("INT", {"default": 1920, "min": 480, "max": 4096, "step": 16}),
                 "video_height": ("INT", {"default": 1080, "min": 480, "max": 4096, "step": 16}),
                 "file_extensions": ("STRING", {"default": "mp4,avi,mov,mkv,flv,wmv", "placeholder": "支持的视频文件扩展名，用逗号分隔"}),
                 "video_quality": (["high", "medium", "fast"], {"default": "high"}),
+                "max_workers": ("INT", {"default": 0, "min": 0, "max": 64, "step": 1, "tooltip": "并行切片的最大任务数，0表示根据CPU核心数自动选择"}),
+                "threads_per_job": ("INT", {"default": 0, "min": 0, "max": 32, "step": 1, "tooltip": "每个FFmpeg切片任务使用的线程数，0表示自动分配"}),
+                "keyframe_tolerance": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 5.0, "step": 0.1, "tooltip": "保持原始比例时，切片边界吸附到关键帧的最大偏移（秒），用于无损流复制切片；0表示禁用"}),
+                "segment_cache_gb": ("FLOAT", {"default": 5.0, "min": 0.0, "max": 1024.0, "step": 0.5, "tooltip": "跨任务复用已切好片段的缓存容量上限（GB），0表示禁用片段缓存"}),
+                "draft_mode": ("BOOLEAN", {"default": False, "tooltip": "草稿模式：以低分辨率和ultrafast预设快速预览，配合输出的剪辑决策表（EDL）做最终渲染"}),
+                "variants": ("INT", {"default": 1, "min": 1, "max": 32, "step": 1, "tooltip": "输出的变体数量，多个变体共用一次切片，各自使用不同的随机顺序"}),
+                "seed": ("INT", {"default": -1, "min": -1, "max": 0xffffffff, "tooltip": "随机顺序的种子，第N个变体使用 seed+N；-1表示每次随机"}),
+                "render_mode": (["segments", "single_pass", "mezzanine"], {"default": "segments", "tooltip": "segments: 先切片再合并；single_pass: 构建单个滤镜图，只编码一次直接输出；mezzanine: 中间片段使用快速全帧内编码，最终只按所选质量编码一次"}),
+                "executor": (["local", "http"], {"default": "local", "tooltip": "local: 在本机并行切片；http: 启动任务队列，其他机器运行 segment_worker.py 领取切片任务"}),
+                "worker_bind": ("STRING", {"default": "127.0.0.1:8765", "tooltip": "http执行器的任务队列监听地址，供其他机器访问时使用 0.0.0.0:端口（必须设置环境变量 TOOLBOX_WORKER_TOKEN）；端口被占用时自动改用空闲端口"}),
             }
         }
 
-    RETURN_TYPES = ("STRING",)
-    RETURN_NAMES = ("video_path",)
+    RETURN_TYPES = ("STRING", "STRING", "STRING")
+    RETURN_NAMES = ("video_path", "video_paths", "edl_json")
     FUNCTION = "combine_videos"
     CATEGORY = "ToolBox/Video"
 
     def combine_videos(self, video_directory, audio_file, filename_prefix, max_clip_duration,
                       aspect_ratio, concat_mode, add_audio_to_video, transition_mode="none", 
                       video_width=1920, video_height=1080, file_extensions="mp4,avi,mov,mkv,flv,wmv",
-                      video_quality="high"):
-        """使用FFmpeg智能合成多个视频文件"""
+                      video_quality="high", max_workers=0, threads_per_job=0, render_mode="segments",
+                      keyframe_tolerance=1.0, segment_cache_gb=5.0, variants=1, seed=-1, draft_mode=False,
+                      executor="local", worker_bind="127.0.0.1:8765"):
+        """使用FFmpeg智能合成多个视频文件，返回第一个输出路径、所有输出路径（每行一个）和剪辑决策表"""
         
         # 检查FFmpeg是否可用
         if not self._check_ffmpeg():
@@ -100,63 +134,53 @@ class SmartVideoCombinerNode:
         output_dir = folder_paths.get_output_directory()
         os.makedirs(output_dir, exist_ok=True)
         
-        # 生成输出文件名
-        output_filename = self._generate_filename(output_dir, filename_prefix)
-        output_path = os.path.join(output_dir, output_filename)
+        # 生成输出文件名，每个变体一个
+        variants = max(1, variants)
+        if draft_mode:
+            filename_prefix = f"{filename_prefix}_draft"
+        output_paths = [
+            os.path.join(output_dir, output_filename)
+            for output_filename in self._generate_filenames(output_dir, filename_prefix, variants)
+        ]
+        if seed is None or seed < 0:
+            seeds = [random.randrange(2 ** 32) for _ in range(variants)]
+        else:
+            seeds = [seed + i for i in range(variants)]
         
         try:
             # 使用FFmpeg处理视频
-            return self._combine_videos_ffmpeg(
+            result_paths, edl_json = self._combine_videos_ffmpeg(
                 video_list, audio_file, audio_duration, target_width, target_height,
-                max_clip_duration, concat_mode, transition_mode, output_path, video_quality, add_audio_to_video, aspect_ratio
+                max_clip_duration, concat_mode, transition_mode, output_paths, video_quality, add_audio_to_video, aspect_ratio,
+                max_workers, threads_per_job, render_mode, keyframe_tolerance, segment_cache_gb, seeds, draft_mode,
+                executor, worker_bind
             )
+            return (result_paths[0], "\n".join(result_paths), edl_json)
             
+        except ProcessingInterrupted:
+            # 用户中断时原样抛出，由ComfyUI显示为已取消而不是错误
+            raise
         except Exception as e:
             print(f"视频合成失败: {str(e)}")
             raise Exception(f"视频合成失败: {str(e)}")
 
     def _check_ffmpeg(self):
-        """检查FFmpeg是否可用"""
-        try:
-            result = subprocess.run(['ffmpeg', '-version'], 
-                                  capture_output=True, text=True, timeout=10)
-            return result.returncode == 0
-        except (subprocess.TimeoutExpired, FileNotFoundError, subprocess.SubprocessError):
-            return False
-
-    def _get_media_duration(self, media_path):
-        """使用FFmpeg获取媒体文件时长"""
+        """检查FFmpeg是否可用，探测结果在进程内缓存"""
+        return get_toolchain().available
+
+    def _get_media_duration(self, media_path, persist=True):
+        """使用FFmpeg获取媒体文件时长（中间文件传入persist=False，不写入持久缓存）"""
         try:
-            cmd = [
-                'ffprobe', '-v', 'quiet', '-print_format', 'json',
-                '-show_format', media_path
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            
-            if result.returncode != 0:
-                raise RuntimeError(f"ffprobe失败: {result.stderr}")
-            
-            data = json.loads(result.stdout)
-            duration = float(data['format']['duration'])
-            return duration
+            return get_media_probe().get_duration(media_path, persist)
             
         except Exception as e:
             print(f"获取媒体时长失败: {str(e)}")
             return 0
 
-    def _get_video_info(self, video_path):
+    def _get_video_info(self, video_path, report_errors=True):
         """获取视频信息"""
         try:
-            cmd = [
-                'ffprobe', '-v', 'quiet', '-print_format', 'json',
-                '-show_streams', '-show_format', video_path
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            
-            if result.returncode != 0:
-                raise RuntimeError(f"ffprobe失败: {result.stderr}")
-            
-            data = json.loads(result.stdout)
+            data = get_media_probe().probe(video_path)
             
             # 查找视频流
             video_stream = None
@@ -172,280 +196,832 @@ class SmartVideoCombinerNode:
                 'duration': float(data['format']['duration']),
                 'width': int(video_stream['width']),
                 'height': int(video_stream['height']),
-                'fps': eval(video_stream.get('r_frame_rate', '30/1')),
+                'fps': parse_frame_rate(video_stream.get('r_frame_rate', '30/1')),
                 'codec': video_stream['codec_name']
             }
             
         except Exception as e:
+            if not report_errors:
+                raise
             print(f"获取视频信息失败 {video_path}: {str(e)}")
             return None
 
+    def _probe_videos(self, video_paths, with_keyframes=False):
+        """并发探测目录中的视频，结果按输入顺序（自然排序）返回，无法解析的视频汇总报告"""
+        directory_index = get_directory_index()
+        
+        def probe(video_path):
+            try:
+                # 优先使用目录索引中保存的元数据，文件变化后重新探测
+                info = directory_index.get_info(video_path)
+                if info is None:
+                    info = self._get_video_info(video_path, report_errors=False)
+                    directory_index.set_info(video_path, info)
+                keyframes = self._get_keyframes(video_path) if with_keyframes else []
+                return info, keyframes, None
+            except Exception as e:
+                return None, [], str(e)
+        
+        if not video_paths:
+            return []
+        
+        workers = max(1, min(self.PROBE_WORKERS, len(video_paths)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(probe, video_paths))
+        
+        failures = [(path, error) for path, (_, _, error) in zip(video_paths, results) if error]
+        if failures:
+            print(f"跳过 {len(failures)} 个无法解析的视频:")
+            for path, error in failures:
+                print(f"  {os.path.basename(path)}: {error}")
+        
+        return [(path, info, keyframes) for path, (info, keyframes, error) in zip(video_paths, results) if not error]
+
     def _combine_videos_ffmpeg(self, video_paths, audio_file, audio_duration, 
                               video_width, video_height, max_clip_duration, 
-                              concat_mode, transition_mode, output_path, video_quality, add_audio_to_video, aspect_ratio):
-        """使用FFmpeg合成视频"""
+                              concat_mode, transition_mode, output_paths, video_quality, add_audio_to_video, aspect_ratio,
+                              max_workers=0, threads_per_job=0, render_mode="segments", keyframe_tolerance=1.0,
+                              segment_cache_gb=5.0, seeds=None, draft_mode=False,
+                              executor="local", worker_bind="127.0.0.1:8765"):
+        """使用FFmpeg合成视频，output_paths包含每个变体的输出路径，返回 (所有输出的绝对路径, 剪辑决策表JSON)"""
+        
+        # 1. 创建子片段计划（所有变体共用一次扫描和探测）
+        print("创建视频切片计划...")
+        keep_original = (aspect_ratio == "keep_original")
+        # 保持原始分辨率时切片边界吸附到关键帧，使用流复制无损切片
+        # 草稿模式也按同样的方式规划，保证剪辑决策表与最终渲染一致
+        snap_tolerance = keyframe_tolerance if keep_original and render_mode == "segments" else 0
+        segments = self._create_segment_plan(video_paths, max_clip_duration, snap_tolerance)
+        print(f"创建了 {len(segments)} 个片段计划")
+        
+        # 2. 为每个变体生成片段顺序
+        seeds = seeds or [None] * len(output_paths)
+        orders = self._get_variant_orders(len(segments), concat_mode, seeds)
         
-        output_dir = os.path.dirname(output_path)
-        temp_dir = os.path.join(output_dir, f"temp_{random.randint(1000, 9999)}")
-        os.makedirs(temp_dir, exist_ok=True)
+        # 剪辑决策表记录完整分辨率的参数，草稿确认后可以直接用它做最终渲染
+        edl_json = build_edl(segments, orders, seeds, {
+            'audio_file': os.path.abspath(audio_file),
+            'audio_duration': audio_duration,
+            'width': video_width,
+            'height': video_height,
+            'aspect_ratio': aspect_ratio,
+            'transition_mode': transition_mode,
+            'add_audio_to_video': add_audio_to_video,
+        })
+        
+        if draft_mode:
+            video_width, video_height = self._get_draft_resolution(video_width, video_height)
+            video_quality = "draft"
+            keep_original = False
+            print(f"草稿模式: {video_width}x{video_height}，ultrafast预设")
+        
+        result_paths = self._render_plan(
+            segments, orders, audio_file, audio_duration, video_width, video_height, transition_mode,
+            output_paths, video_quality, add_audio_to_video, keep_original,
+            max_workers, threads_per_job, render_mode, segment_cache_gb, executor, worker_bind
+        )
+        return result_paths, edl_json
+
+    def _render_plan(self, segments, orders, audio_file, audio_duration, video_width, video_height, transition_mode,
+                     output_paths, video_quality, add_audio_to_video, keep_original,
+                     max_workers=0, threads_per_job=0, render_mode="segments", segment_cache_gb=5.0,
+                     executor="local", worker_bind="127.0.0.1:8765"):
+        """按切片计划和每个变体的片段顺序渲染输出，返回所有输出的绝对路径"""
+        if transition_mode == "crossfade" and not get_toolchain().has_filter("xfade"):
+            print("当前FFmpeg不支持xfade滤镜，交叉淡化改为直接拼接")
+            transition_mode = "none"
+        
+        # 在本地临时工作空间中处理，最终结果再原子地移动到输出目录
+        scratch = get_scratch_space()
+        scratch.ensure_space(
+            self._estimate_scratch_bytes(audio_duration, video_width, video_height, render_mode) * len(output_paths)
+        )
+        temp_dir = scratch.create_job_dir("smart_combine")
         
         try:
-            # 1. 创建子片段计划
-            print("创建视频切片计划...")
-            segments = self._create_segment_plan(video_paths, max_clip_duration)
-            
-            # 2. 随机打乱顺序（如果需要）
-            if concat_mode == "random":
-                random.shuffle(segments)
-                print("已随机打乱片段顺序")
-            
-            print(f"创建了 {len(segments)} 个片段计划")
-            
-            # 3. 批量切片视频
-            print("开始批量切片视频...")
-            keep_original = (aspect_ratio == "keep_original")
-            segment_files = self._batch_cut_segments(segments, temp_dir, video_width, video_height, video_quality, keep_original)
+            results = [None] * len(output_paths)
+            pending_variants = list(range(len(output_paths)))
             
-            # 4. 根据音频长度调整片段列表
-            print("调整片段列表以匹配音频长度...")
-            final_segments = self._adjust_segments_for_audio(segment_files, audio_duration)
+            # 单次渲染模式和交叉淡化都在同一个滤镜图中完成切片、缩放和过渡，只编码一次
+            if render_mode == "single_pass" or transition_mode == "crossfade":
+                overlap = self._get_transition_overlap(segments, transition_mode)
+                for variant in list(pending_variants):
+                    timeline = self._fit_segments_to_audio(segments, orders[variant], audio_duration, overlap)
+                    # 交叉淡化需要完整的输入列表用于分批渲染
+                    inputs = self._build_single_pass_inputs(
+                        segments, timeline, merge=(transition_mode == "none"),
+                        limit=None if transition_mode == "crossfade" else self.SINGLE_PASS_MAX_INPUTS
+                    )
+                    staged_output = os.path.join(temp_dir, os.path.basename(output_paths[variant]))
+                    if len(inputs) <= self.SINGLE_PASS_MAX_INPUTS:
+                        self._render_single_pass(
+                            inputs, audio_file if add_audio_to_video else None, staged_output,
+                            video_width, video_height, self._get_target_fps(segments), video_quality, temp_dir,
+                            transition_mode, overlap
+                        )
+                    elif transition_mode == "crossfade":
+                        self._render_crossfade_batches(
+                            inputs, audio_file if add_audio_to_video else None, staged_output,
+                            video_width, video_height, self._get_target_fps(segments), video_quality, temp_dir, overlap
+                        )
+                    else:
+                        print(f"时间线包含 {len(inputs)} 个输入，超过单次渲染上限 {self.SINGLE_PASS_MAX_INPUTS}，回退到分段模式")
+                        continue
+                    results[variant] = scratch.commit(staged_output, output_paths[variant])
+                    pending_variants.remove(variant)
+                    print(f"视频合成完成: {output_paths[variant]}")
             
-            # 5. 应用过渡效果（如果需要）
-            if transition_mode != "none":
-                print(f"应用过渡效果: {transition_mode}")
-                final_segments = self._apply_transitions_ffmpeg(final_segments, transition_mode, temp_dir)
-            
-            # 6. 合并所有片段
-            print("开始合并视频片段...")
-            merged_video = self._concat_segments_ffmpeg(final_segments, temp_dir)
+            if pending_variants:
+                # 3. 先在计划上匹配音频长度，所有变体用到的片段只切一次
+                # 淡入/淡出效果在切片时一并编码，不需要额外的编码过程
+                print("根据音频长度规划片段并切片...")
+                fade_mode = transition_mode if transition_mode in ("fade_in", "fade_out") else "none"
+                segment_cache = SegmentCache(int(segment_cache_gb * 1024 ** 3)) if segment_cache_gb > 0 else None
+                # 中间格式模式下切片只是中间结果，使用快速编码参数
+                segment_quality = "mezzanine" if render_mode == "mezzanine" else video_quality
+                # 已完成的切片记录在任务日志中，中断后使用相同输入重新运行时可以继续
+                journal = scratch.open_journal(self._get_journal_key(
+                    segments, video_width, video_height, segment_quality, fade_mode, keep_original
+                ))
+                if journal is None:
+                    print("相同输入的任务正在运行，本次切片使用独立的临时目录（不记录任务日志）")
+                try:
+                    variant_segments = self._cut_fitted_segments(
+                        segments, [orders[variant] for variant in pending_variants], audio_duration, temp_dir,
+                        video_width, video_height, segment_quality, keep_original,
+                        max_workers, threads_per_job, segment_cache, fade_mode, journal, executor, worker_bind
+                    )
+                    
+                    if render_mode != "mezzanine":
+                        # 所有变体的片段统一预检一次，保证每个变体都可以流复制拼接
+                        variant_segments = self._preflight_variants(
+                            variant_segments, temp_dir, video_quality, max_workers, threads_per_job
+                        )
+                    
+                    for variant, final_segments in zip(pending_variants, variant_segments):
+                        results[variant] = self._assemble_variant(
+                            final_segments, audio_file, output_paths[variant], temp_dir, video_quality,
+                            add_audio_to_video, render_mode, scratch
+                        )
+                    
+                    # 所有变体都已输出，删除任务日志和其中的切片
+                    if journal:
+                        journal.complete()
+                finally:
+                    if journal:
+                        scratch.release_journal(journal)
             
-            # 7. 添加音频或直接输出
-            if add_audio_to_video:
-                print("添加音频轨道...")
-                self._add_audio_to_video(merged_video, audio_file, output_path, video_quality)
-            else:
-                print("不添加音频，直接输出合并后的视频...")
-                # 将合并后的视频移动到最终输出路径
-                shutil.move(merged_video, output_path)
-            
-            print(f"视频合成完成: {output_path}")
-            return (os.path.abspath(output_path),)
+            return [os.path.abspath(path) for path in results]
             
         finally:
             # 清理临时目录
-            self._cleanup_temp_dir(temp_dir)
+            scratch.remove_job_dir(temp_dir)
+
+    def _get_journal_key(self, segments, target_width, target_height, quality, transition_mode, keep_original):
+        """任务日志键：源视频指纹、切片计划和切片编码参数都相同时才继续之前的任务"""
+        probe = get_media_probe()
+        sources = [probe.fingerprint(source_path) for source_path, _ in segments.sources]
+        clips = [
+            (segments.source_index(index), round(segment['start_time'], 3), round(segment['end_time'], 3),
+             segment['stream_copy'])
+            for index, segment in enumerate(segments)
+        ]
+        size = "original" if keep_original else f"{target_width}x{target_height}"
+        return JobJournal.make_key(sources, clips, size, self._get_quality_params(quality), transition_mode)
 
-    def _create_segment_plan(self, video_paths, max_clip_duration):
-        """创建视频切片计划"""
-        segments = []
+    def _get_variant_orders(self, segment_count, concat_mode, seeds):
+        """生成每个变体的片段顺序：单个顺序变体保持原顺序，其余按种子随机打乱"""
+        orders = []
+        for seed in seeds:
+            order = list(range(segment_count))
+            if concat_mode == "random" or len(seeds) > 1:
+                random.Random(seed).shuffle(order)
+            orders.append(order)
+        if len(seeds) > 1:
+            if concat_mode != "random":
+                print("生成多个变体时每个变体都使用随机顺序")
+            print(f"生成 {len(seeds)} 个变体，随机种子: {', '.join(str(seed) for seed in seeds)}")
+        elif concat_mode == "random":
+            print("已随机打乱片段顺序")
+        return orders
+
+    def _preflight_variants(self, variant_segments, temp_dir, quality, max_workers=0, threads_per_job=0):
+        """对所有变体用到的切片文件统一做流参数预检，同一个文件只归一化一次"""
+        paths = list(dict.fromkeys(
+            file_path for timeline_files in variant_segments for file_path in timeline_files.distinct_files()
+        ))
+        if not paths:
+            return variant_segments
+        normalized = self._preflight_files(paths, temp_dir, quality, max_workers, threads_per_job)
+        if not normalized:
+            return variant_segments
         
-        for video_path in video_paths:
-            video_info = self._get_video_info(video_path)
-            if not video_info:
-                print(f"跳过无法解析的视频: {video_path}")
-                continue
-            
+        # 只替换映射中的文件路径，时间线保持不变
+        files = {
+            job_key: normalized.get(file_path, file_path)
+            for job_key, file_path in variant_segments[0].files.items()
+        }
+        return [TimelineFiles(timeline_files.timeline, files, timeline_files.resolve)
+                for timeline_files in variant_segments]
+
+    def _assemble_variant(self, final_segments, audio_file, output_path, temp_dir, video_quality,
+                          add_audio_to_video, render_mode, scratch):
+        """把已切好的片段拼接为一个变体并移动到输出路径"""
+        staged_output = os.path.join(temp_dir, os.path.basename(output_path))
+        
+        if render_mode == "mezzanine":
+            # 合并、最终编码和封装音频在同一次FFmpeg调用中完成
+            print("合并中间片段并按所选质量编码最终输出...")
+            self._encode_final_video(
+                final_segments, audio_file if add_audio_to_video else None, staged_output, video_quality, temp_dir
+            )
+            scratch.commit(staged_output, output_path)
+            print(f"视频合成完成: {output_path}")
+            return output_path
+        
+        # 4. 合并所有片段（已经预检过流参数）
+        print("开始合并视频片段...")
+        merged_video = self._concat_segments_ffmpeg(final_segments, temp_dir, video_quality)
+        
+        # 5. 添加音频或直接输出
+        if add_audio_to_video:
+            print("添加音频轨道...")
+            self._add_audio_to_video(merged_video, audio_file, staged_output, video_quality)
+            scratch.commit(staged_output, output_path)
+        else:
+            print("不添加音频，直接输出合并后的视频...")
+            # 将合并后的视频移动到最终输出路径
+            scratch.commit(merged_video, output_path)
+        
+        print(f"视频合成完成: {output_path}")
+        return output_path
+
+    def _create_segment_plan(self, video_paths, max_clip_duration, keyframe_tolerance=0):
+        """创建视频切片计划，keyframe_tolerance大于0时切片边界吸附到关键帧"""
+        segments = SegmentPlan()
+        
+        for video_path, video_info, keyframes in self._probe_videos(video_paths, keyframe_tolerance > 0):
+            source_index = segments.add_source(video_path, video_info)
             duration = video_info['duration']
             start_time = 0
+            # 视频开头总是可以直接流复制
+            start_on_keyframe = bool(keyframes)
             
             while start_time < duration:
                 end_time = min(start_time + max_clip_duration, duration)
+                end_on_keyframe = end_time >= duration
+                
+                if keyframes and not end_on_keyframe:
+                    snapped = self._nearest_keyframe(keyframes, end_time, keyframe_tolerance, start_time + 1.0)
+                    if snapped is not None:
+                        end_time = min(snapped, duration)
+                        end_on_keyframe = True
+                
                 segment_duration = end_time - start_time
                 
                 # 只有足够长的片段才添加
                 if segment_duration >= 1.0:  # 至少1秒
-                    segments.append({
-                        'source_path': video_path,
-                        'start_time': start_time,
-                        'end_time': end_time,
-                        'duration': segment_duration,
-                        'source_info': video_info
-                    })
+                    segments.append(source_index, start_time, end_time, start_on_keyframe)
                 
                 start_time = end_time
+                start_on_keyframe = bool(keyframes) and end_on_keyframe
         
         return segments
 
-    def _batch_cut_segments(self, segments, temp_dir, target_width, target_height, quality, keep_original=False):
-        """批量切片视频"""
-        segment_files = []
+    def _get_keyframes(self, video_path):
+        """通过ffprobe的数据包标记获取视频关键帧时间点（相对文件起始时间）"""
+        try:
+            return get_media_probe().get_keyframes(video_path)
+            
+        except Exception as e:
+            print(f"获取关键帧失败 {video_path}: {str(e)}")
+            return []
+
+    def _nearest_keyframe(self, keyframes, target_time, tolerance, min_time):
+        """查找距离目标时间最近且在容差范围内的关键帧，找不到时返回None"""
+        position = bisect.bisect_left(keyframes, target_time)
+        candidates = [
+            keyframes[i] for i in (position - 1, position)
+            if 0 <= i < len(keyframes) and keyframes[i] >= min_time and abs(keyframes[i] - target_time) <= tolerance
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda keyframe: abs(keyframe - target_time))
+
+    def _batch_cut_segments(self, segments, temp_dir, target_width, target_height, quality, keep_original=False,
+                            max_workers=0, threads_per_job=0, segment_ids=None, segment_cache=None,
+                            transition_mode="none", journal=None, executor="local", worker_bind="127.0.0.1:8765"):
+        """批量并行切片视频，返回与输入片段一一对应的结果列表，失败的片段为None
+        
+        提供任务日志时，切片写入日志目录，每完成一个切片立即记录；
+        executor为http时通过任务队列把切片分发给其他机器上的工作进程
+        """
+        if not segments:
+            return []
+        
+        # 片段编号用于生成临时文件名，默认按输入顺序编号
+        if segment_ids is None:
+            segment_ids = [f"{i:04d}" for i in range(len(segments))]
         
         # 设置质量参数
         quality_params = self._get_quality_params(quality)
         
+        # 计算并行任务数和每个任务的线程数，避免CPU超额订阅
+        workers, threads = self._resolve_worker_budget(len(segments), max_workers, threads_per_job)
+        print(f"并行切片: {workers} 个任务并行，每个任务 {threads} 线程")
+        
+        output_dir = journal.directory if journal else temp_dir
+        results = [None] * len(segments)
+        jobs = []
         for i, segment in enumerate(segments):
-            segment_file = os.path.join(temp_dir, f"segment_{i:04d}.mp4")
-            
+            segment_file = os.path.join(output_dir, f"segment_{segment_ids[i]}.mp4")
+            cached, job = self._prepare_cut_job(
+                i, len(segments), segment, segment_file, target_width, target_height, quality_params,
+                keep_original, threads, segment_cache, transition_mode
+            )
+            if cached:
+                results[i] = cached
+                if journal:
+                    journal.record(segment_ids[i], segment['source_path'], cached)
+            else:
+                job['job_id'] = segment_ids[i]
+                job['index'] = i
+                jobs.append(job)
+        
+        progress_bar = create_progress_bar(len(jobs))
+        
+        def on_complete(job, ok, error):
+            # 在调度线程中回调，写入片段缓存和任务日志
+            if progress_bar is not None:
+                progress_bar.update(1)
+            i = job['index']
+            segment = segments[i]
+            if not ok:
+                print(f"切片失败 {os.path.basename(segment['source_path'])}: {error}")
+                return
+            segment_file = job['output_path']
+            if segment_cache:
+                segment_file = segment_cache.store(job['cache_key'], segment_file)
+            results[i] = {
+                'file_path': segment_file,
+                'duration': segment['duration'],
+                'cache_key': job['cache_key']
+            }
+            if journal:
+                journal.record(segment_ids[i], segment['source_path'], results[i])
+        
+        create_segment_executor(executor, workers, worker_bind).run(jobs, on_complete)
+        
+        print(f"成功创建 {sum(1 for result in results if result)} 个视频片段")
+        return results
+
+    def _prepare_cut_job(self, index, total, segment, segment_file, target_width, target_height,
+                         quality_params, keep_original, threads, segment_cache=None, transition_mode="none"):
+        """准备单个视频片段的切片任务，返回 (缓存命中的结果, 切片任务)，两者只有一个不为None
+        
+        任务中的FFmpeg命令使用输入/输出占位符，本机和远程工作进程各自替换为实际路径
+        """
+        fade_filter = self._get_fade_filter(transition_mode, segment['duration'])
+        # 需要淡入淡出时必须重新编码
+        stream_copy = self._is_stream_copy(segment, keep_original, transition_mode)
+        
+        # 先查找片段缓存，命中时直接复用
+        cache_key = None
+        if segment_cache:
+            if keep_original:
+                size_key = ("original", "original")
+            else:
+                size_key = (target_width, target_height)
+            preset_key = "copy" if stream_copy else " ".join(quality_params + [fade_filter])
+            cache_key = segment_cache.make_key(
+                segment['source_path'], segment['start_time'], segment['duration'],
+                size_key[0], size_key[1], preset_key
+            )
+            cached_file = segment_cache.lookup(cache_key)
+            if cached_file:
+                print(f"切片 {index+1}/{total}: 命中片段缓存 {os.path.basename(segment['source_path'])} ({segment['start_time']:.1f}s-{segment['end_time']:.1f}s)")
+                return {
+                    'file_path': cached_file,
+                    'duration': segment['duration'],
+                    'cache_key': cache_key
+                }, None
+        
+        if stream_copy:
+            # 起点位于关键帧，直接流复制，无需重新编码
+            cmd = [
+                get_toolchain().ffmpeg, '-y',
+                '-ss', str(segment['start_time']),
+                '-i', INPUT_PLACEHOLDER,
+                '-t', str(segment['duration']),
+                '-map', '0:v:0',
+                '-c', 'copy',
+                '-an',  # 移除音频
+                '-avoid_negative_ts', 'make_zero',
+                '-f', 'mp4',
+                OUTPUT_PLACEHOLDER
+            ]
+        else:
             # 构建FFmpeg命令
             cmd = [
-                'ffmpeg', '-y',
-                '-i', segment['source_path'],
+                get_toolchain().ffmpeg, '-y',
+                '-i', INPUT_PLACEHOLDER,
                 '-ss', str(segment['start_time']),
                 '-t', str(segment['duration']),
             ]
             
             # 如果需要保持原始分辨率，不添加缩放滤镜
+            video_filters = []
             if not keep_original:
-                cmd.extend(['-vf', f'scale={target_width}:{target_height}:force_original_aspect_ratio=decrease,pad={target_width}:{target_height}:(ow-iw)/2:(oh-ih)/2:black'])
+                video_filters.append(f'scale={target_width}:{target_height}:force_original_aspect_ratio=decrease,pad={target_width}:{target_height}:(ow-iw)/2:(oh-ih)/2:black')
+            if fade_filter:
+                video_filters.append(fade_filter)
+            if video_filters:
+                cmd.extend(['-vf', ",".join(video_filters)])
             
             cmd.extend([
                 '-c:v', 'libx264',
             ] + quality_params + [
+                '-threads', str(threads),
                 '-an',  # 移除音频
-                segment_file
+                '-f', 'mp4',
+                OUTPUT_PLACEHOLDER
             ])
-            
-            print(f"切片 {i+1}/{len(segments)}: {os.path.basename(segment['source_path'])} ({segment['start_time']:.1f}s-{segment['end_time']:.1f}s)")
-            if keep_original:
-                print(f"  保持原始分辨率: {segment['source_info']['width']}x{segment['source_info']['height']}")
-            
-            try:
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-                if result.returncode != 0:
-                    print(f"切片失败: {result.stderr}")
-                    continue
-                
-                if os.path.exists(segment_file):
-                    segment_files.append({
-                        'file_path': segment_file,
-                        'duration': segment['duration']
-                    })
-                    
-            except subprocess.TimeoutExpired:
-                print(f"切片超时: {segment['source_path']}")
-                continue
-            except Exception as e:
-                print(f"切片错误: {str(e)}")
-                continue
         
-        print(f"成功创建 {len(segment_files)} 个视频片段")
-        return segment_files
+        print(f"切片 {index+1}/{total}: {os.path.basename(segment['source_path'])} ({segment['start_time']:.1f}s-{segment['end_time']:.1f}s)")
+        if keep_original:
+            mode_text = "无损流复制" if stream_copy else "重新编码"
+            print(f"  保持原始分辨率: {segment['source_info']['width']}x{segment['source_info']['height']} ({mode_text})")
+        
+        return None, {
+            'cmd': cmd,
+            'input_path': segment['source_path'],
+            'output_path': segment_file,
+            'cache_key': cache_key,
+            'timeout': 300,
+        }
 
-    def _adjust_segments_for_audio(self, segment_files, audio_duration):
-        """调整片段列表以匹配音频长度"""
-        if not segment_files:
-            return []
+    def _resolve_worker_budget(self, job_count, max_workers=0, threads_per_job=0):
+        """计算并行任务数与每个任务的线程数，保证 任务数 x 线程数 不超过CPU核心数"""
+        cpu_count = os.cpu_count() or 1
         
-        # 计算当前视频总时长
-        total_duration = sum(seg['duration'] for seg in segment_files)
+        if threads_per_job > 0:
+            threads = threads_per_job
+        elif max_workers > 0:
+            threads = cpu_count // max_workers
+        else:
+            # 自动模式：大机器上每个任务分配少量线程，小机器上单线程多任务
+            threads = min(4, cpu_count // 4)
+        threads = max(1, min(threads, cpu_count))
         
-        if total_duration >= audio_duration:
-            # 视频时长足够，截取到音频长度
-            adjusted_segments = []
-            current_duration = 0
-            
-            for segment in segment_files:
-                if current_duration >= audio_duration:
-                    break
-                
-                remaining_time = audio_duration - current_duration
-                if segment['duration'] <= remaining_time:
-                    adjusted_segments.append(segment)
-                    current_duration += segment['duration']
-                else:
-                    # 需要截取最后一个片段
-                    if remaining_time > 0.5:  # 至少保留0.5秒
-                        adjusted_segments.append({
-                            'file_path': segment['file_path'],
-                            'duration': remaining_time
-                        })
-                    break
+        workers = max_workers if max_workers > 0 else cpu_count // threads
+        workers = max(1, min(workers, cpu_count // threads, job_count))
+        
+        return workers, threads
+
+    def _cut_fitted_segments(self, segments, orders, audio_duration, temp_dir, target_width, target_height, quality,
+                             keep_original=False, max_workers=0, threads_per_job=0, segment_cache=None,
+                             transition_mode="none", journal=None, executor="local", worker_bind="127.0.0.1:8765"):
+        """先按音频长度为每个排列规划时间线，再只切出所有时间线用到的片段（重复片段只切一次）
+        
+        被截短的片段：可以流复制时直接复用完整片段，由concat列表的outpoint截取；
+        需要重新编码时单独按精确时长切出，保证输出时长与音频一致；
+        任务日志中已完成的切片直接复用；返回与orders一一对应的 TimelineFiles，
+        拼接时逐个条目解析切片文件，不展开完整的时间线
+        """
+        cut_files = {}
+        failed = set()
+        completed = journal.load() if journal else {}
+        timelines = [[] for _ in orders]
+        
+        while True:
+            # 跳过切片失败的片段，重新规划时间线
+            orders = [[index for index in order if index not in failed] for order in orders]
+            timelines = [self._fit_segments_to_audio(segments, order, audio_duration) for order in orders]
+            if not any(orders):
+                break
             
-            return adjusted_segments
-        else:
-            # 视频时长不够，需要循环
-            print(f"视频时长 ({total_duration:.2f}s) 短于音频时长 ({audio_duration:.2f}s)，开始循环")
+            # 循环的时间线和多个变体之间只需要切出不重复的条目
+            pending = {}
+            for timeline in timelines:
+                for index, duration in timeline.distinct():
+                    job_key = self._timeline_job_key(segments, index, duration, keep_original, transition_mode)
+                    if job_key in cut_files or job_key in pending:
+                        continue
+                    entry = completed.get(self._timeline_job_id(job_key))
+                    if entry:
+                        cut_files[job_key] = {
+                            'file_path': entry['file_path'],
+                            'duration': entry['duration'],
+                            'cache_key': entry.get('cache_key')
+                        }
+                    else:
+                        pending[job_key] = self._timeline_job_segment(segments, index, duration)
+            resumed = sum(1 for job_key in cut_files if self._timeline_job_id(job_key) in completed)
+            if resumed:
+                print(f"从任务日志继续: 复用 {resumed} 个已完成的切片")
+            if not pending:
+                break
             
-            adjusted_segments = []
-            current_duration = 0
+            print(f"需要切片 {len(pending)} 个片段（计划共 {len(segments)} 个）")
+            job_keys = list(pending)
+            results = self._batch_cut_segments(
+                [pending[job_key] for job_key in job_keys], temp_dir, target_width, target_height, quality,
+                keep_original, max_workers, threads_per_job,
+                segment_ids=[self._timeline_job_id(job_key) for job_key in job_keys],
+                segment_cache=segment_cache, transition_mode=transition_mode, journal=journal,
+                executor=executor, worker_bind=worker_bind
+            )
             
-            for segment in itertools.cycle(segment_files):
-                if current_duration >= audio_duration:
-                    break
-                
-                remaining_time = audio_duration - current_duration
-                if segment['duration'] <= remaining_time:
-                    adjusted_segments.append(segment)
-                    current_duration += segment['duration']
+            newly_failed = False
+            for job_key, result in zip(job_keys, results):
+                if result:
+                    cut_files[job_key] = result
                 else:
-                    # 截取最后部分
-                    if remaining_time > 0.5:
-                        adjusted_segments.append({
-                            'file_path': segment['file_path'],
-                            'duration': remaining_time
-                        })
-                    break
+                    failed.add(job_key[0])
+                    newly_failed = True
             
-            print(f"循环后共 {len(adjusted_segments)} 个片段，总时长: {current_duration:.2f}s")
-            return adjusted_segments
+            if not newly_failed:
+                break
+        
+        # 按容量上限淘汰旧片段，本次任务用到的片段不会被淘汰
+        if segment_cache:
+            segment_cache.evict(protect=[result.get('cache_key') for result in cut_files.values()])
+        
+        # 所有变体共用同一个 切片任务键 -> 文件路径 映射
+        files = {job_key: result['file_path'] for job_key, result in cut_files.items()}
+        resolve = lambda index, duration: self._timeline_job_key(
+            segments, index, duration, keep_original, transition_mode
+        )
+        return [TimelineFiles(timeline, files, resolve) for timeline in timelines]
 
-    def _apply_transitions_ffmpeg(self, segments, transition_mode, temp_dir):
-        """使用FFmpeg应用过渡效果"""
-        if transition_mode == "none" or len(segments) <= 1:
-            return segments
+    def _timeline_job_key(self, segments, index, duration, keep_original=False, transition_mode="none"):
+        """时间线条目对应的切片任务键
         
-        processed_segments = []
+        被截短的片段需要重新编码时按截取时长单独成为一个任务；
+        可以流复制时与完整片段共用一个任务，拼接时由outpoint截取，不额外编码
+        """
+        if duration < segments.duration(index) - 1e-3 and not self._is_stream_copy(
+                segments[index], keep_original, transition_mode):
+            return (index, round(duration, 3))
+        return (index, None)
+
+    def _is_stream_copy(self, segment, keep_original, transition_mode="none"):
+        """片段是否以流复制方式切出（与 _prepare_cut_job 的判断一致）"""
+        return (keep_original and segment.get('stream_copy', False)
+                and not self._get_fade_filter(transition_mode, segment['duration']))
+
+    def _timeline_job_id(self, job_key):
+        """切片任务的临时文件编号"""
+        index, tail_duration = job_key
+        if tail_duration is None:
+            return f"{index:04d}"
+        return f"{index:04d}_tail_{int(tail_duration * 1000)}"
+
+    def _timeline_job_segment(self, segments, index, duration):
+        """生成时间线条目的切片参数，截短的片段（只在需要重新编码时单独切出）按精确时长编码"""
+        segment = segments[index]
+        if duration >= segment['duration'] - 1e-3:
+            return segment
+        tail = dict(segment)
+        tail['duration'] = duration
+        tail['end_time'] = segment['start_time'] + duration
+        return tail
+
+    def _fit_segments_to_audio(self, segments, order, audio_duration, overlap=0):
+        """在片段计划上匹配音频长度，返回按需迭代 (片段索引, 使用时长) 的时间线
         
-        for i, segment in enumerate(segments):
-            output_file = os.path.join(temp_dir, f"transition_{i:04d}.mp4")
-            
-            # 构建过渡效果命令
-            if transition_mode == "fade_in":
-                vf_filter = "fade=in:0:30"
-            elif transition_mode == "fade_out":
-                vf_filter = "fade=out:st=0:d=1"
-            elif transition_mode == "crossfade":
-                # 简单的淡入淡出组合
-                vf_filter = "fade=in:0:15,fade=out:st=0:d=1"
+        overlap为相邻片段交叉过渡的重叠时长，除第一个片段外每个片段的有效时长都会减去重叠部分
+        """
+        timeline = fit_timeline(segments, order, audio_duration, overlap)
+        if len(timeline) > len(order):
+            # 视频时长不够，需要循环
+            print(f"视频时长短于音频时长 ({audio_duration:.2f}s)，循环 {timeline.cycles} 轮后共 "
+                  f"{len(timeline)} 个片段，总时长: {timeline.total_duration:.2f}s")
+        return timeline
+
+    def _get_transition_overlap(self, segments, transition_mode):
+        """交叉淡化的重叠时长，不超过最短片段的一半"""
+        if transition_mode != "crossfade" or not segments:
+            return 0
+        shortest = min(segments.duration(index) for index in range(len(segments)))
+        return min(self.TRANSITION_DURATION, shortest / 2)
+
+    def _get_fade_filter(self, transition_mode, duration):
+        """生成单个片段的淡入/淡出滤镜，不需要时返回空字符串"""
+        fade_duration = min(self.TRANSITION_DURATION, duration / 2)
+        if transition_mode == "fade_in":
+            return f"fade=t=in:st=0:d={fade_duration:.3f}"
+        elif transition_mode == "fade_out":
+            return f"fade=t=out:st={duration - fade_duration:.3f}:d={fade_duration:.3f}"
+        return ""
+
+    def _build_single_pass_inputs(self, segments, timeline, merge=True, limit=None):
+        """把时间线转换为单次渲染的输入列表，merge为True时合并同一视频中首尾相接的片段
+        
+        输入数量超过limit时提前返回（调用方会回退到分段模式）
+        """
+        inputs = []
+        for index, duration in timeline:
+            if limit is not None and len(inputs) > limit:
+                break
+            segment = segments[index]
+            previous = inputs[-1] if inputs else None
+            if (merge and previous and previous['source_path'] == segment['source_path']
+                    and abs(previous['start_time'] + previous['duration'] - segment['start_time']) < 1e-6):
+                previous['duration'] += duration
             else:
-                # 跳过未知效果
-                processed_segments.append(segment)
-                continue
-            
-            cmd = [
-                'ffmpeg', '-y',
-                '-i', segment['file_path'],
-                '-vf', vf_filter,
-                '-c:v', 'libx264', '-preset', 'fast',
-                output_file
-            ]
+                inputs.append({
+                    'source_path': segment['source_path'],
+                    'start_time': segment['start_time'],
+                    'duration': duration
+                })
+        return inputs
+
+    def _get_target_fps(self, segments):
+        """以第一个源视频的帧率作为输出帧率"""
+        for _, source_info in segments.sources:
+            fps = source_info.get('fps')
+            if fps and fps > 0:
+                return round(fps, 3)
+        return 30
+
+    def _render_single_pass(self, inputs, audio_file, output_path, target_width, target_height, fps, quality, temp_dir,
+                            transition_mode="none", overlap=0):
+        """构建单个 trim/setpts/scale/pad/concat 滤镜图，过渡效果也在同一滤镜图中完成，一次编码直接写入输出文件"""
+        if not inputs:
+            raise ValueError("没有可合并的片段")
+        
+        cmd = [get_toolchain().ffmpeg, '-y']
+        filters = []
+        # 视频流可能比计划时长（来自容器时长）短，用最后一帧补足后再截取，保证每个输入的时长与计划完全一致，
+        # 否则后续xfade的offset会错位或输出被截短
+        pad_to_plan = get_toolchain().has_filter("tpad")
+        for i, item in enumerate(inputs):
+            # 输入端快速定位，每个输入只解码需要的区间
+            cmd.extend([
+                '-ss', f"{item['start_time']:.3f}",
+                '-t', f"{item['duration']:.3f}",
+                '-i', item['source_path']
+            ])
+            chain = (
+                f"[{i}:v]trim=duration={item['duration']:.3f},setpts=PTS-STARTPTS,"
+                f"scale={target_width}:{target_height}:force_original_aspect_ratio=decrease,"
+                f"pad={target_width}:{target_height}:(ow-iw)/2:(oh-ih)/2:black,"
+                f"setsar=1,fps={fps},format=yuv420p,"
+            )
+            if pad_to_plan:
+                chain += f"tpad=stop_mode=clone:stop_duration={item['duration']:.3f},trim=duration={item['duration']:.3f},"
+            chain += "settb=AVTB"
+            fade_filter = self._get_fade_filter(transition_mode, item['duration'])
+            if fade_filter:
+                chain += f",{fade_filter}"
+            filters.append(chain + f"[v{i}]")
+        
+        if transition_mode == "crossfade" and len(inputs) > 1:
+            # 使用xfade在相邻片段之间做真正的交叉淡化
+            previous_label = "v0"
+            offset = inputs[0]['duration'] - overlap
+            for i in range(1, len(inputs)):
+                output_label = "outv" if i == len(inputs) - 1 else f"x{i}"
+                filters.append(
+                    f"[{previous_label}][v{i}]xfade=transition=fade:duration={overlap:.3f}:offset={offset:.3f}[{output_label}]"
+                )
+                offset += inputs[i]['duration'] - overlap
+                previous_label = output_label
+        else:
+            filters.append("".join(f"[v{i}]" for i in range(len(inputs))) + f"concat=n={len(inputs)}:v=1:a=0[outv]")
+        
+        # 滤镜图可能很长，写入脚本文件避免命令行过长
+        filter_script = os.path.join(temp_dir, "filter_graph.txt")
+        with open(filter_script, 'w', encoding='utf-8') as f:
+            f.write(";\n".join(filters))
+        
+        # 音频作为最后一个输入，与视频在同一次调用中封装
+        if audio_file:
+            cmd.extend(['-i', audio_file])
+        cmd.extend(['-filter_complex_script', filter_script, '-map', '[outv]'])
+        if audio_file:
+            cmd.extend(['-map', f'{len(inputs)}:a:0'] + get_audio_codec_args(audio_file, output_path))
+        cmd.extend(['-c:v', 'libx264'] + self._get_quality_params(quality) + [output_path])
+        
+        print(f"单次渲染: {len(inputs)} 个输入，直接编码到输出文件...")
+        try:
+            result = run_ffmpeg(cmd, timeout=3600, duration=self._get_output_duration(inputs, overlap))
+        except subprocess.TimeoutExpired:
+            result = None
+        
+        if result is None or result.returncode != 0 or not os.path.exists(output_path):
+            # 删除不完整的输出文件
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            if result is None:
+                raise RuntimeError("单次渲染超时")
+            raise RuntimeError(f"单次渲染失败: {result.stderr}")
+
+    def _render_crossfade_batches(self, inputs, audio_file, output_path, target_width, target_height, fps, quality,
+                                  temp_dir, overlap):
+        """
+        输入数超过单次渲染上限时分批渲染交叉淡化
+        每批最多 SINGLE_PASS_MAX_INPUTS 个输入，先用xfade渲染为全帧内中间格式，
+        再对各批结果做一次交叉淡化并按用户选择的质量编码输出，批次衔接处的过渡与批内一致
+        """
+        batch_size = self.SINGLE_PASS_MAX_INPUTS
+        batch_count = (len(inputs) + batch_size - 1) // batch_size
+        if batch_count > batch_size:
+            raise RuntimeError(
+                f"时间线包含 {len(inputs)} 个输入，超过交叉淡化支持的上限 {batch_size * batch_size}，请使用更长的片段时长"
+            )
+        
+        total_duration = self._get_output_duration(inputs, overlap)
+        get_scratch_space().ensure_space(
+            self._estimate_scratch_bytes(total_duration, target_width, target_height, "mezzanine")
+        )
+        print(f"时间线包含 {len(inputs)} 个输入，超过单次渲染上限 {batch_size}，分 {batch_count} 批渲染交叉淡化")
+        
+        batches = []
+        try:
+            for i in range(batch_count):
+                batch_file = os.path.join(temp_dir, f"crossfade_batch_{i:04d}.mp4")
+                print(f"交叉淡化第 {i + 1}/{batch_count} 批...")
+                self._render_single_pass(
+                    inputs[i * batch_size:(i + 1) * batch_size], None, batch_file,
+                    target_width, target_height, fps, "mezzanine", temp_dir, "crossfade", overlap
+                )
+                # 使用实际时长计算批次之间的过渡位置
+                batch_duration = self._get_media_duration(batch_file, persist=False)
+                if batch_duration <= overlap:
+                    raise RuntimeError(f"交叉淡化第 {i + 1} 批的输出时长无效: {batch_duration}")
+                batches.append({'source_path': batch_file, 'start_time': 0.0, 'duration': batch_duration})
             
-            try:
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=180)
-                if result.returncode == 0 and os.path.exists(output_file):
-                    processed_segments.append({
-                        'file_path': output_file,
-                        'duration': segment['duration']
-                    })
-                else:
-                    # 效果应用失败，使用原始片段
-                    processed_segments.append(segment)
-            except Exception as e:
-                print(f"应用过渡效果失败: {str(e)}")
-                processed_segments.append(segment)
+            self._render_single_pass(
+                batches, audio_file, output_path, target_width, target_height, fps, quality, temp_dir,
+                "crossfade", overlap
+            )
+        finally:
+            for batch in batches:
+                if os.path.exists(batch['source_path']):
+                    os.remove(batch['source_path'])
+
+    def _preflight_files(self, paths, temp_dir, quality, max_workers=0, threads_per_job=0):
+        """预检拼接输入的流参数，只把不一致的文件重新编码为参考格式，保证可以流复制拼接
+        
+        返回 {原路径: 归一化后的路径}，所有文件一致时返回空字典
+        """
+        reference, mismatches = plan_normalization(paths)
+        if not mismatches:
+            return {}
+        
+        print(f"流参数预检: {len(mismatches)} 个片段与参考格式不一致，仅重新编码这些片段")
+        for path, fields in mismatches.items():
+            print(f"  {os.path.basename(path)}: {', '.join(fields)}")
         
-        return processed_segments
+        quality_params = self._get_quality_params(quality)
+        normalized = self._normalize_files(list(mismatches), reference, temp_dir, quality_params,
+                                           max_workers, threads_per_job)
+        
+        # 重新编码的片段与参考片段的参数集（SPS/PPS）不同时（例如参考片段是相机直出的流复制片段），
+        # 参考片段也要用同一编码器重新编码：拼接后的文件只有一份参数集
+        sample = next(iter(normalized.values()), None)
+        if sample and diff_signatures(get_stream_signature(sample, persist=False), reference):
+            rest = [path for path in paths if path not in mismatches]
+            print(f"流参数预检: 重新编码的片段与参考片段的编码参数集不同，其余 {len(rest)} 个片段也重新编码")
+            normalized.update(self._normalize_files(rest, reference, temp_dir, quality_params,
+                                                    max_workers, threads_per_job, first_index=len(mismatches)))
+        return normalized
 
-    def _concat_segments_ffmpeg(self, segments, temp_dir):
-        """使用FFmpeg合并片段"""
+    def _normalize_files(self, paths, reference, temp_dir, quality_params, max_workers=0, threads_per_job=0,
+                         first_index=0):
+        """并行把文件重新编码为参考格式，返回 {原路径: 归一化后的路径}（失败的文件不包含在内）"""
+        workers, threads = self._resolve_worker_budget(len(paths), max_workers, threads_per_job)
+        normalized = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for i, path in enumerate(paths, first_index):
+                output_file = os.path.join(temp_dir, f"normalized_{i:04d}.mp4")
+                futures[executor.submit(normalize_file, path, output_file, reference, quality_params, threads)] = (path, output_file)
+            for future in as_completed(futures):
+                path, output_file = futures[future]
+                if future.result():
+                    normalized[path] = output_file
+        
+        if len(normalized) < len(paths):
+            print(f"警告: {len(paths) - len(normalized)} 个片段归一化失败，合并时可能需要重新编码")
+        return normalized
+
+    def _concat_segments_ffmpeg(self, segments, temp_dir, quality="high"):
+        """使用FFmpeg按时间线合并片段（调用方已预检流参数），优先使用流复制拼接
+        
+        只有一个条目时也经过concat：流复制的完整片段需要由outpoint截取
+        """
         if not segments:
             raise ValueError("没有可合并的片段")
         
-        if len(segments) == 1:
-            return segments[0]['file_path']
-        
-        # 创建文件列表
-        filelist_path = os.path.join(temp_dir, "filelist.txt")
-        with open(filelist_path, 'w', encoding='utf-8') as f:
-            for segment in segments:
-                # 使用绝对路径并转义特殊字符
-                file_path = os.path.abspath(segment['file_path']).replace('\\', '\\\\').replace("'", "\\'")
-                f.write(f"file '{file_path}'\n")
+        filelist_path = self._write_concat_list(segments, temp_dir)
         
         # 合并文件
         merged_file = os.path.join(temp_dir, "merged_video.mp4")
         cmd = [
-            'ffmpeg', '-y',
+            get_toolchain().ffmpeg, '-y',
             '-f', 'concat',
             '-safe', '0',
             '-i', filelist_path,
@@ -455,21 +1031,22 @@ class SmartVideoCombinerNode:
         
         print("执行视频合并...")
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+            result = run_ffmpeg(cmd, timeout=600, duration=segments.total_duration)
             if result.returncode != 0:
-                print(f"合并失败，尝试重新编码: {result.stderr}")
+                print(f"流复制合并失败，回退到重新编码: {result.stderr}")
                 
                 # 尝试重新编码合并
                 cmd_reencode = [
-                    'ffmpeg', '-y',
+                    get_toolchain().ffmpeg, '-y',
                     '-f', 'concat',
                     '-safe', '0',
                     '-i', filelist_path,
-                    '-c:v', 'libx264', '-preset', 'fast',
+                    '-c:v', 'libx264',
+                ] + self._get_quality_params(quality) + [
                     merged_file
                 ]
                 
-                result = subprocess.run(cmd_reencode, capture_output=True, text=True, timeout=900)
+                result = run_ffmpeg(cmd_reencode, timeout=900, duration=segments.total_duration)
                 if result.returncode != 0:
                     raise RuntimeError(f"视频合并失败: {result.stderr}")
             
@@ -481,24 +1058,64 @@ class SmartVideoCombinerNode:
         except subprocess.TimeoutExpired:
             raise RuntimeError("视频合并超时")
 
+    def _get_output_duration(self, segments, overlap=0):
+        """计算拼接后的输出时长（秒），用于显示进度"""
+        durations = [segment.get('outpoint') or segment['duration'] for segment in segments]
+        return max(0, sum(durations) - overlap * max(0, len(durations) - 1))
+
+    def _write_concat_list(self, segments, temp_dir):
+        """按时间线逐个条目写出concat分离器使用的文件列表，segments迭代 (文件路径, 使用时长)"""
+        filelist_path = os.path.join(temp_dir, "filelist.txt")
+        with open(filelist_path, 'w', encoding='utf-8') as f:
+            for file_path, duration in segments:
+                # 使用绝对路径并转义单引号
+                f.write(concat_file_line(file_path))
+                # 出点指令，保证每个片段只贡献时间线上需要的时长
+                f.write(f"outpoint {duration:.3f}\n")
+        return filelist_path
+
+    def _encode_final_video(self, segments, audio_file, output_path, quality, temp_dir):
+        """合并中间片段并按用户选择的质量编码最终输出，可同时封装音频"""
+        if not segments:
+            raise ValueError("没有可合并的片段")
+        
+        filelist_path = self._write_concat_list(segments, temp_dir)
+        cmd = [
+            get_toolchain().ffmpeg, '-y',
+            '-f', 'concat',
+            '-safe', '0',
+            '-i', filelist_path,
+        ]
+        if audio_file:
+            cmd.extend(['-i', audio_file, '-map', '0:v:0', '-map', '1:a:0'] + get_audio_codec_args(audio_file, output_path))
+        cmd.extend(['-c:v', 'libx264'] + self._get_quality_params(quality) + ['-pix_fmt', 'yuv420p', output_path])
+        
+        try:
+            result = run_ffmpeg(cmd, timeout=1800, duration=segments.total_duration)
+            if result.returncode != 0:
+                raise RuntimeError(f"最终编码失败: {result.stderr}")
+            
+            if not os.path.exists(output_path):
+                raise RuntimeError("最终输出文件不存在")
+                
+        except subprocess.TimeoutExpired:
+            raise RuntimeError("最终编码超时")
+
     def _add_audio_to_video(self, video_path, audio_path, output_path, quality):
         """将音频添加到视频"""
-        quality_params = self._get_quality_params(quality)
-        
         cmd = [
-            'ffmpeg', '-y',
+            get_toolchain().ffmpeg, '-y',
             '-i', video_path,
             '-i', audio_path,
             '-c:v', 'copy',  # 视频不重新编码
-            '-c:a', 'aac',
+        ] + get_audio_codec_args(audio_path, output_path) + [  # 音频格式兼容时也直接复制
             '-map', '0:v:0',
             '-map', '1:a:0',
-            '-shortest',  # 以较短的流为准
         ] + [output_path]
         
         print("添加音频轨道...")
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+            result = run_ffmpeg(cmd, timeout=300, duration=self._get_media_duration(video_path, persist=False))
             if result.returncode != 0:
                 raise RuntimeError(f"添加音频失败: {result.stderr}")
             
@@ -510,7 +1127,11 @@ class SmartVideoCombinerNode:
 
     def _get_quality_params(self, quality):
         """获取视频质量参数"""
-        if quality == "high":
+        if quality == "mezzanine":
+            return list(self.MEZZANINE_PARAMS)
+        elif quality == "draft":
+            return list(self.DRAFT_PARAMS)
+        elif quality == "high":
             return ['-preset', 'slow', '-crf', '18']
         elif quality == "medium":
             return ['-preset', 'medium', '-crf', '23']
@@ -542,23 +1163,21 @@ class SmartVideoCombinerNode:
         else:
             return video_width, video_height
 
-    def _cleanup_temp_dir(self, temp_dir):
-        """清理临时目录"""
-        try:
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
-                print(f"已清理临时目录: {temp_dir}")
-        except Exception as e:
-            print(f"清理临时目录失败: {str(e)}")
+    def _get_draft_resolution(self, width, height):
+        """草稿分辨率：等比缩小到最长边不超过DRAFT_MAX_SIZE，宽高保持偶数"""
+        scale = min(1.0, self.DRAFT_MAX_SIZE / max(width, height))
+        return max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2)
+
+    def _estimate_scratch_bytes(self, duration, width, height, render_mode="segments"):
+        """粗略估算任务需要的临时空间（按约0.5字节/像素/秒计算，全帧内中间格式约为8倍）"""
+        bytes_per_pixel = 4.0 if render_mode == "mezzanine" else 0.5
+        return int(duration * width * height * bytes_per_pixel)
 
-    def _generate_filename(self, output_dir, prefix):
-        """生成不重复的文件名"""
+    def _generate_filenames(self, output_dir, prefix, count):
+        """生成count个连续编号且不重复的文件名"""
         pattern = os.path.join(output_dir, f"{prefix}_????.mp4")
         existing_files = glob.glob(pattern)
         
-        if not existing_files:
-            return f"{prefix}_0001.mp4"
-        
         max_number = 0
         for file in existing_files:
             match = re.search(r'_(\d{4})\.mp4$', file)
@@ -566,48 +1185,19 @@ class SmartVideoCombinerNode:
                 number = int(match.group(1))
                 max_number = max(max_number, number)
         
-        new_number = max_number + 1
-        return f"{prefix}_{new_number:04d}.mp4"
+        return [f"{prefix}_{max_number + i:04d}.mp4" for i in range(1, count + 1)]
 
     def _get_video_list(self, video_directory, file_extensions):
-        """获取视频目录中的所有视频文件，按文件名排序"""
+        """获取视频目录中的所有视频文件，按文件名自然排序（使用持久化目录索引）"""
         # 解析支持的文件扩展名
         extensions = [ext.strip().lower() for ext in file_extensions.split(',')]
         
-        video_files = []
-        
-        # 遍历目录中的所有文件
         try:
-            for filename in os.listdir(video_directory):
-                file_path = os.path.join(video_directory, filename)
-                
-                # 检查是否为文件
-                if os.path.isfile(file_path):
-                    # 检查文件扩展名
-                    file_ext = filename.lower().split('.')[-1] if '.' in filename else ''
-                    if file_ext in extensions:
-                        video_files.append(file_path)
-            
-            # 自然排序（处理数字文件名）
-            def natural_sort_key(filename):
-                import re
-                # 提取文件名中的数字部分进行排序
-                parts = re.split(r'(\d+)', os.path.basename(filename).lower())
-                # 将数字部分转换为整数，非数字部分保持字符串
-                for i in range(len(parts)):
-                    try:
-                        parts[i] = int(parts[i])
-                    except ValueError:
-                        pass
-                return parts
-            
-            video_files.sort(key=natural_sort_key)
+            return get_directory_index().list_files(video_directory, extensions)
             
         except Exception as e:
             print(f"读取视频目录失败: {str(e)}")
             return []
-        
-        return video_files
 
 # 节点注册
 NODE_CLASS_MAPPINGS = {
@@ -0,0 +1,97 @@
+import os
+import folder_paths
+from .smart_video_combiner import SmartVideoCombinerNode
+from .edit_decision_list import load_edl
+from .ffmpeg_runner import ProcessingInterrupted
+
+
+class SmartVideoEDLRenderNode(SmartVideoCombinerNode):
+    """
+    剪辑决策表渲染节点 - 按 Smart Video Combiner 输出的EDL渲染视频
+    直接使用EDL中记录的素材、入点/出点和片段顺序，
+    跳过目录扫描、视频探测和切片规划，适合草稿确认后做最终渲染
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "edl_json": ("STRING", {"default": "", "multiline": True, "placeholder": "Smart Video Combiner 输出的剪辑决策表（JSON）"}),
+                "filename_prefix": ("STRING", {"default": "smart_combined"}),
+            },
+            "optional": {
+                "video_quality": (["high", "medium", "fast"], {"default": "high"}),
+                "render_mode": (["segments", "single_pass", "mezzanine"], {"default": "segments", "tooltip": "segments: 先切片再合并；single_pass: 构建单个滤镜图，只编码一次直接输出；mezzanine: 中间片段使用快速全帧内编码，最终只按所选质量编码一次"}),
+                "max_workers": ("INT", {"default": 0, "min": 0, "max": 64, "step": 1, "tooltip": "并行切片的最大任务数，0表示根据CPU核心数自动选择"}),
+                "threads_per_job": ("INT", {"default": 0, "min": 0, "max": 32, "step": 1, "tooltip": "每个FFmpeg切片任务使用的线程数，0表示自动分配"}),
+                "segment_cache_gb": ("FLOAT", {"default": 5.0, "min": 0.0, "max": 1024.0, "step": 0.5, "tooltip": "跨任务复用已切好片段的缓存容量上限（GB），0表示禁用片段缓存"}),
+                "draft_mode": ("BOOLEAN", {"default": False, "tooltip": "草稿模式：以低分辨率和ultrafast预设快速预览"}),
+                "executor": (["local", "http"], {"default": "local", "tooltip": "local: 在本机并行切片；http: 启动任务队列，其他机器运行 segment_worker.py 领取切片任务"}),
+                "worker_bind": ("STRING", {"default": "127.0.0.1:8765", "tooltip": "http执行器的任务队列监听地址，供其他机器访问时使用 0.0.0.0:端口（必须设置环境变量 TOOLBOX_WORKER_TOKEN）；端口被占用时自动改用空闲端口"}),
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("video_path", "video_paths")
+    FUNCTION = "render_edl"
+    CATEGORY = "ToolBox/Video"
+
+    def render_edl(self, edl_json, filename_prefix, video_quality="high", render_mode="segments",
+                   max_workers=0, threads_per_job=0, segment_cache_gb=5.0, draft_mode=False,
+                   executor="local", worker_bind="127.0.0.1:8765"):
+        """按剪辑决策表渲染所有变体，返回第一个输出路径和所有输出路径（每行一个）"""
+
+        # 检查FFmpeg是否可用
+        if not self._check_ffmpeg():
+            raise RuntimeError("FFmpeg未找到，请确保FFmpeg已安装并在PATH中")
+
+        segments, orders, seeds, settings = load_edl(edl_json)
+        audio_file = settings.get('audio_file', "")
+        if not os.path.exists(audio_file):
+            raise FileNotFoundError(f"音频文件不存在: {audio_file}")
+
+        audio_duration = float(settings['audio_duration'])
+        video_width = int(settings['width'])
+        video_height = int(settings['height'])
+        keep_original = settings.get('aspect_ratio') == "keep_original"
+        transition_mode = settings.get('transition_mode', "none")
+        add_audio_to_video = bool(settings.get('add_audio_to_video', False))
+        print(f"剪辑决策表: {len(segments.sources)} 个视频，{len(segments)} 个片段，{len(orders)} 个变体")
+
+        if draft_mode:
+            video_width, video_height = self._get_draft_resolution(video_width, video_height)
+            video_quality = "draft"
+            keep_original = False
+            filename_prefix = f"{filename_prefix}_draft"
+            print(f"草稿模式: {video_width}x{video_height}，ultrafast预设")
+
+        # 获取输出目录
+        output_dir = folder_paths.get_output_directory()
+        os.makedirs(output_dir, exist_ok=True)
+        output_paths = [
+            os.path.join(output_dir, output_filename)
+            for output_filename in self._generate_filenames(output_dir, filename_prefix, len(orders))
+        ]
+
+        try:
+            result_paths = self._render_plan(
+                segments, orders, audio_file, audio_duration, video_width, video_height, transition_mode,
+                output_paths, video_quality, add_audio_to_video, keep_original,
+                max_workers, threads_per_job, render_mode, segment_cache_gb, executor, worker_bind
+            )
+            return (result_paths[0], "\n".join(result_paths))
+
+        except ProcessingInterrupted:
+            raise
+        except Exception as e:
+            print(f"视频渲染失败: {str(e)}")
+            raise Exception(f"视频渲染失败: {str(e)}")
+
+
+NODE_CLASS_MAPPINGS = {
+    "SmartVideoEDLRenderNode": SmartVideoEDLRenderNode
+}
+
+NODE_DISPLAY_NAME_MAPPINGS = {
+    "SmartVideoEDLRenderNode": "Smart Video EDL Render (FFmpeg)"
+}
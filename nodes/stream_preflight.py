@@ -0,0 +1,164 @@
+import subprocess
+from collections import Counter
+from .media_probe import get_media_probe
+from .ffmpeg_runner import run_ffmpeg
+from .toolchain import get_toolchain
+
+# 流复制拼接要求一致的视频流参数
+# 拼接后整个文件只有一份参数集（avcC中的SPS/PPS），level和extradata_hash不一致的文件也不能直接拼接
+COMPARE_FIELDS = (
+    'codec_name', 'profile', 'level', 'pix_fmt', 'width', 'height', 'time_base', 'fps', 'sample_aspect_ratio',
+    'extradata_hash',
+)
+
+# 可以重新编码为相同格式的编解码器
+ENCODERS = {
+    'h264': 'libx264',
+    'hevc': 'libx265',
+}
+
+# ffprobe输出的profile名称 -> 编码器的 -profile:v 参数
+PROFILES = {
+    'h264': {
+        'Constrained Baseline': 'baseline',
+        'Baseline': 'baseline',
+        'Main': 'main',
+        'High': 'high',
+        'High 10': 'high10',
+        'High 4:2:2': 'high422',
+        'High 4:4:4 Predictive': 'high444',
+    },
+    'hevc': {
+        'Main': 'main',
+        'Main 10': 'main10',
+    },
+}
+
+# 参考格式无法编码时使用的默认格式
+DEFAULT_CODEC = ('h264', 'High', 'yuv420p')
+
+
+def get_stream_signature(video_path, persist=True):
+    """获取视频流的拼接兼容性参数，没有视频流或探测失败时返回None
+
+    探测临时切片、归一化文件等中间文件时传入 persist=False，避免写入媒体探测的持久缓存
+    """
+    try:
+        stream = get_media_probe().get_stream(video_path, 'video', persist)
+    except Exception as e:
+        print(f"获取视频流参数失败: {video_path}, 错误: {str(e)}")
+        return None
+    if stream is None:
+        return None
+
+    sar = stream.get('sample_aspect_ratio') or '1:1'
+    if sar in ('0:1', 'N/A'):
+        sar = '1:1'
+    return {
+        'codec_name': stream.get('codec_name'),
+        'profile': stream.get('profile'),
+        'level': stream.get('level'),
+        'pix_fmt': stream.get('pix_fmt'),
+        'width': int(stream.get('width', 0)),
+        'height': int(stream.get('height', 0)),
+        'time_base': stream.get('time_base'),
+        'fps': stream.get('r_frame_rate'),
+        'sample_aspect_ratio': sar,
+        # 旧版ffprobe不支持 -show_data_hash 时为None，此时无法比较参数集
+        'extradata_hash': stream.get('extradata_hash'),
+    }
+
+
+def diff_signatures(signature, reference):
+    """返回与参考格式不一致的字段列表"""
+    if signature is None:
+        return list(COMPARE_FIELDS)
+    return [field for field in COMPARE_FIELDS if signature.get(field) != reference.get(field)]
+
+
+def is_encodable(signature):
+    """检查是否能重新编码出与该格式一致的视频流"""
+    return signature is not None and signature.get('codec_name') in ENCODERS
+
+
+def choose_reference(signatures):
+    """选择出现次数最多的可编码格式作为参考，使需要重新编码的文件最少"""
+    counter = Counter(
+        tuple(signature[field] for field in COMPARE_FIELDS)
+        for signature in signatures if signature is not None
+    )
+    for values, _ in counter.most_common():
+        reference = dict(zip(COMPARE_FIELDS, values))
+        if is_encodable(reference):
+            return reference
+
+    # 没有可编码的格式，全部转为默认格式
+    if not counter:
+        return None
+    reference = dict(zip(COMPARE_FIELDS, counter.most_common(1)[0][0]))
+    reference['codec_name'], reference['profile'], reference['pix_fmt'] = DEFAULT_CODEC
+    # 编码格式改变后原来的level和参数集都不再适用
+    reference['level'], reference['extradata_hash'] = None, None
+    return reference
+
+
+def plan_normalization(video_paths):
+    """预检拼接输入（切片等中间文件），返回 (参考格式, {需要归一化的路径: 不一致的字段})"""
+    unique_paths = list(dict.fromkeys(video_paths))
+    signatures = {path: get_stream_signature(path, persist=False) for path in unique_paths}
+    reference = choose_reference(signatures.values())
+    if reference is None:
+        return None, {}
+
+    mismatches = {}
+    for path, signature in signatures.items():
+        fields = diff_signatures(signature, reference)
+        if fields:
+            mismatches[path] = fields
+    return reference, mismatches
+
+
+def build_encode_args(reference, quality_params, video_filters=None):
+    """生成与参考格式一致的视频编码参数（包含滤镜）"""
+    codec = reference['codec_name']
+    filters = list(video_filters or [])
+    filters.append(f"scale={reference['width']}:{reference['height']}")
+    filters.append(f"setsar={reference['sample_aspect_ratio'].replace(':', '/')}")
+    if reference.get('fps'):
+        filters.append(f"fps={reference['fps']}")
+
+    args = ['-vf', ",".join(filters), '-c:v', ENCODERS[codec]] + list(quality_params)
+    profile = PROFILES.get(codec, {}).get(reference.get('profile'))
+    if profile:
+        args.extend(['-profile:v', profile])
+    level = reference.get('level')
+    if codec == 'h264' and isinstance(level, int) and level > 0:
+        # ffprobe输出的level为 level_idc（如 40 表示 4.0），libx264可以直接使用
+        args.extend(['-level:v', str(level)])
+    if reference.get('pix_fmt'):
+        args.extend(['-pix_fmt', reference['pix_fmt']])
+
+    # MP4/MOV容器的时间基由轨道时间刻度决定
+    time_base = reference.get('time_base') or ''
+    if '/' in time_base:
+        args.extend(['-video_track_timescale', time_base.split('/', 1)[1]])
+    return args
+
+
+def normalize_file(source_path, output_path, reference, quality_params, threads=0):
+    """把单个文件重新编码为参考格式（只保留视频流），成功返回True"""
+    cmd = [get_toolchain().ffmpeg, '-y', '-i', source_path, '-map', '0:v:0']
+    cmd.extend(build_encode_args(reference, quality_params))
+    if threads:
+        cmd.extend(['-threads', str(threads)])
+    cmd.extend(['-an', output_path])
+
+    try:
+        result = run_ffmpeg(cmd, timeout=600, progress=False)
+    except subprocess.TimeoutExpired:
+        print(f"格式归一化超时: {source_path}")
+        return False
+    if result.returncode != 0:
+        print(f"格式归一化失败: {result.stderr}")
+        return False
+    return True
@@ -0,0 +1,130 @@
+import os
+import re
+import shutil
+import subprocess
+import threading
+
+# 环境变量可以指定FFmpeg/ffprobe的完整路径
+FFMPEG_ENV = "TOOLBOX_FFMPEG"
+FFPROBE_ENV = "TOOLBOX_FFPROBE"
+
+# 各功能需要的最低FFmpeg版本（开发版构建视为最新版本）
+FEATURE_VERSIONS = {
+    'stream_loop': (2, 8),
+    'progress': (2, 0),
+    'data_hash': (3, 0),
+}
+
+_VERSION_PATTERN = re.compile(r"version\s+n?(\d+)\.(\d+)")
+_ENCODER_PATTERN = re.compile(r"^\s*[VASFXBD.]{6}\s+(\S+)\s")
+_FILTER_PATTERN = re.compile(r"^\s*[TSC.|]{2,3}\s+(\S+)\s+\S+->\S+")
+
+
+def _find_binary(name, env_var, sibling=None):
+    """按 环境变量 -> 与ffmpeg同目录 -> PATH -> imageio-ffmpeg自带的二进制 的顺序查找可执行文件"""
+    path = os.environ.get(env_var)
+    if path:
+        return path
+
+    if sibling:
+        directory = os.path.dirname(sibling)
+        for candidate in (name, name + ".exe"):
+            path = os.path.join(directory, candidate)
+            if directory and os.path.isfile(path):
+                return path
+
+    path = shutil.which(name)
+    if path:
+        return path
+
+    if name == "ffmpeg":
+        try:
+            import imageio_ffmpeg
+            return imageio_ffmpeg.get_ffmpeg_exe()
+        except Exception:
+            pass
+    return None
+
+
+class Toolchain:
+    """
+    FFmpeg工具链 - 进程内只探测一次
+    解析ffmpeg/ffprobe的路径（不启动子进程），版本、编码器和滤镜在首次查询时各探测一次后缓存，
+    节点据此选择可用的最快处理方式，不需要每次执行都运行 ffmpeg -version
+    """
+
+    def __init__(self):
+        # 找不到时保留命令名，执行时由调用方报告错误（imageio-ffmpeg不带ffprobe）
+        self.ffmpeg = _find_binary("ffmpeg", FFMPEG_ENV) or "ffmpeg"
+        self.ffprobe = _find_binary("ffprobe", FFPROBE_ENV, self.ffmpeg) or "ffprobe"
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def _query(self, key, args, parse):
+        """运行一次ffmpeg查询命令并缓存解析结果，失败时缓存空结果"""
+        with self._lock:
+            if key not in self._cache:
+                output = ""
+                try:
+                    result = subprocess.run(
+                        [self.ffmpeg, '-hide_banner'] + args, capture_output=True, text=True, timeout=30
+                    )
+                    if result.returncode == 0:
+                        output = result.stdout
+                except (subprocess.TimeoutExpired, OSError) as e:
+                    print(f"FFmpeg探测失败: {str(e)}")
+                self._cache[key] = parse(output)
+            return self._cache[key]
+
+    @property
+    def version(self):
+        """FFmpeg版本 (主版本, 次版本)；开发版构建返回 (9999, 0)，不可用时返回None"""
+        def parse(output):
+            if not output:
+                return None
+            match = _VERSION_PATTERN.search(output.splitlines()[0])
+            return (int(match.group(1)), int(match.group(2))) if match else (9999, 0)
+        return self._query('version', ['-version'], parse)
+
+    @property
+    def available(self):
+        return self.version is not None
+
+    @property
+    def encoders(self):
+        def parse(output):
+            names = {match.group(1) for match in map(_ENCODER_PATTERN.match, output.splitlines()) if match}
+            names.discard("=")
+            return frozenset(names)
+        return self._query('encoders', ['-encoders'], parse)
+
+    @property
+    def filters(self):
+        def parse(output):
+            return frozenset(match.group(1) for match in map(_FILTER_PATTERN.match, output.splitlines()) if match)
+        return self._query('filters', ['-filters'], parse)
+
+    def has_encoder(self, name):
+        return name in self.encoders
+
+    def has_filter(self, name):
+        return name in self.filters
+
+    def supports(self, feature):
+        """检查命令行功能（如 stream_loop）是否被当前FFmpeg版本支持"""
+        version = self.version
+        return version is not None and version >= FEATURE_VERSIONS[feature]
+
+
+_toolchain = None
+_toolchain_lock = threading.Lock()
+
+
+def get_toolchain():
+    """获取进程内共享的FFmpeg工具链"""
+    global _toolchain
+    if _toolchain is None:
+        with _toolchain_lock:
+            if _toolchain is None:
+                _toolchain = Toolchain()
+    return _toolchain
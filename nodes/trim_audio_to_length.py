@@ -1,8 +1,10 @@
 import os
-import subprocess
 import glob
 import re
 import folder_paths
+from .media_probe import get_media_probe
+from .ffmpeg_runner import run_ffmpeg
+from .toolchain import get_toolchain
 
 class TrimAudioToLength:
     @classmethod
@@ -95,26 +97,18 @@ class TrimAudioToLength:
         return f"{prefix}_{new_number:04d}{extension}"
     
     def _get_duration(self, audio_file):
-        """获取音频文件的时长（秒）"""
-        cmd = [
-            "ffprobe", 
-            "-v", "error", 
-            "-show_entries", "format=duration", 
-            "-of", "default=noprint_wrappers=1:nokey=1", 
-            audio_file
-        ]
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        return float(result.stdout.strip())
+        """获取音频文件的时长（秒），结果由共享的探测缓存提供"""
+        return get_media_probe().get_duration(audio_file)
     
     def _trim_audio(self, input_file, output_file, target_duration):
         """裁剪音频到指定时长"""
-        subprocess.run([
-            "ffmpeg", "-y", "-i", input_file, "-t", str(target_duration),
+        run_ffmpeg([
+            get_toolchain().ffmpeg, "-y", "-i", input_file, "-t", str(target_duration),
             "-c:a", "copy", output_file
-        ], check=True)
+        ], duration=target_duration, check=True)
         
     def _copy_audio(self, input_file, output_file):
         """复制音频文件"""
-        subprocess.run([
-            "ffmpeg", "-y", "-i", input_file, "-c:a", "copy", output_file
+        run_ffmpeg([
+            get_toolchain().ffmpeg, "-y", "-i", input_file, "-c:a", "copy", output_file
         ], check=True) 
\ No newline at end of file
@@ -1,10 +1,13 @@
 import os
 import subprocess
-import requests
 import tempfile
 import folder_paths
 from urllib.parse import urlparse
 import re
+from .media_probe import get_media_probe
+from .scratch_space import get_scratch_space
+from .ffmpeg_runner import run_ffmpeg, ProcessingInterrupted
+from .toolchain import get_toolchain
 
 class VideoAudioRemoverNode:
     @classmethod
@@ -42,6 +45,9 @@ class VideoAudioRemoverNode:
 
     def download_video(self, url, output_path):
         """下载视频文件到指定路径"""
+        # requests在首次执行时再导入，不影响ComfyUI启动
+        import requests
+        
         try:
             print(f"开始下载视频: {url}")
             
@@ -74,16 +80,7 @@ class VideoAudioRemoverNode:
     def has_audio_track(self, video_path):
         """检查视频是否包含音频轨道"""
         try:
-            cmd = [
-                'ffprobe', '-v', 'quiet', '-select_streams', 'a', 
-                '-show_entries', 'stream=codec_type', '-of', 'csv=p=0', 
-                video_path
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            
-            # 如果有输出内容，说明存在音频轨道
-            return len(result.stdout.strip()) > 0
+            return get_media_probe().has_stream(video_path, 'audio')
             
         except Exception as e:
             print(f"检查音频轨道时出错: {str(e)}")
@@ -96,7 +93,7 @@ class VideoAudioRemoverNode:
             print(f"开始移除音频: {input_path}")
             
             cmd = [
-                'ffmpeg', '-y',  # -y 覆盖输出文件
+                get_toolchain().ffmpeg, '-y',  # -y 覆盖输出文件
                 '-i', input_path,
                 '-c:v', 'copy',  # 复制视频流，不重新编码
                 '-an',  # 移除音频流
@@ -104,12 +101,7 @@ class VideoAudioRemoverNode:
                 output_path
             ]
             
-            result = subprocess.run(
-                cmd, 
-                capture_output=True, 
-                text=True, 
-                timeout=300  # 5分钟超时
-            )
+            result = run_ffmpeg(cmd, timeout=300, progress=False)  # 5分钟超时，流复制很快，不显示进度
             
             if result.returncode == 0:
                 print(f"音频移除完成: {output_path}")
@@ -121,6 +113,8 @@ class VideoAudioRemoverNode:
         except subprocess.TimeoutExpired:
             print("音频移除超时")
             return False
+        except ProcessingInterrupted:
+            raise
         except Exception as e:
             print(f"移除音频时出错: {str(e)}")
             return False
@@ -141,6 +135,7 @@ class VideoAudioRemoverNode:
         return ext if ext else ".mp4"
 
     def remove_audio(self, filename_prefix, video_url="", video_path=""):
+        job_dir = None
         try:
             # 验证输入参数
             if not video_url.strip() and not video_path.strip():
@@ -149,6 +144,10 @@ class VideoAudioRemoverNode:
             if video_url.strip() and video_path.strip():
                 raise ValueError("不能同时提供 video_url 和 video_path，请只选择一个")
 
+            # 下载文件和中间结果放在本地临时工作空间中
+            scratch = get_scratch_space()
+            job_dir = scratch.create_job_dir("audio_remover")
+
             # 确定输入视频文件路径
             input_video_path = None
             temp_downloaded_file = None
@@ -164,10 +163,7 @@ class VideoAudioRemoverNode:
                 extension = self.get_video_extension(url_path)
                 
                 # 创建临时下载文件
-                temp_downloaded_file = os.path.join(
-                    self.output_dir, 
-                    f"temp_download_{filename_prefix}_{os.getpid()}{extension}"
-                )
+                temp_downloaded_file = os.path.join(job_dir, f"download{extension}")
                 
                 if not self.download_video(video_url.strip(), temp_downloaded_file):
                     raise RuntimeError("视频下载失败")
@@ -194,16 +190,8 @@ class VideoAudioRemoverNode:
                 # 生成输出文件名和路径
                 output_filename, output_path = self.get_next_filename(filename_prefix, video_extension)
                 
-                # 直接复制文件
-                import shutil
-                shutil.copy2(input_video_path, output_path)
-                
-                # 清理临时文件
-                if temp_downloaded_file and os.path.exists(temp_downloaded_file):
-                    try:
-                        os.remove(temp_downloaded_file)
-                    except:
-                        pass
+                # 下载的文件直接移动到输出路径，本地文件则复制
+                scratch.commit(input_video_path, output_path, keep_source=temp_downloaded_file is None)
                 
                 print(f"处理完成，输出文件: {output_path}")
                 return (output_path,)
@@ -211,36 +199,31 @@ class VideoAudioRemoverNode:
             # 生成输出文件名和路径
             output_filename, output_path = self.get_next_filename(filename_prefix, video_extension)
             
+            # 先写入临时工作目录，完成后再移动到输出路径
+            staged_output = os.path.join(job_dir, f"output{video_extension}")
+            
             # 移除音频
-            if self.remove_audio_from_video(input_video_path, output_path):
+            if self.remove_audio_from_video(input_video_path, staged_output):
                 # 验证输出文件是否生成
-                if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+                if os.path.exists(staged_output) and os.path.getsize(staged_output) > 0:
+                    scratch.commit(staged_output, output_path)
                     print(f"音频移除成功，输出文件: {output_path}")
-                    
-                    # 清理临时文件
-                    if temp_downloaded_file and os.path.exists(temp_downloaded_file):
-                        try:
-                            os.remove(temp_downloaded_file)
-                        except:
-                            pass
-                    
                     return (output_path,)
                 else:
                     raise RuntimeError("输出文件生成失败")
             else:
                 raise RuntimeError("音频移除处理失败")
 
+        except ProcessingInterrupted:
+            raise
         except Exception as e:
-            # 清理临时文件
-            if 'temp_downloaded_file' in locals() and temp_downloaded_file and os.path.exists(temp_downloaded_file):
-                try:
-                    os.remove(temp_downloaded_file)
-                except:
-                    pass
-            
             error_msg = f"视频音频移除失败: {str(e)}"
             print(error_msg)
             raise RuntimeError(error_msg)
+        finally:
+            # 清理临时工作目录
+            if job_dir:
+                scratch.remove_job_dir(job_dir)
 
 # 节点映射
 NODE_CLASS_MAPPINGS = {
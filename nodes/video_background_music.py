@@ -1,11 +1,15 @@
 import os
 import subprocess
-import requests
 import tempfile
 import folder_paths
 from urllib.parse import urlparse
 import re
 import shutil
+from .media_probe import get_media_probe
+from .scratch_space import get_scratch_space
+from .ffmpeg_runner import run_ffmpeg, ProcessingInterrupted
+from .toolchain import get_toolchain
+from .media_mux import get_audio_codec_args
 
 class VideoBackgroundMusicNode:
     """
@@ -90,6 +94,9 @@ class VideoBackgroundMusicNode:
 
     def download_file(self, url, output_path, file_type="文件"):
         """下载文件到指定路径"""
+        # requests在首次执行时再导入，不影响ComfyUI启动
+        import requests
+        
         try:
             print(f"开始下载{file_type}: {url}")
             
@@ -122,20 +129,7 @@ class VideoBackgroundMusicNode:
     def get_media_duration(self, media_path):
         """获取媒体文件时长"""
         try:
-            cmd = [
-                'ffprobe', '-v', 'quiet', '-print_format', 'json',
-                '-show_format', media_path
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            
-            if result.returncode != 0:
-                print(f"ffprobe失败: {result.stderr}")
-                return 0
-            
-            import json
-            data = json.loads(result.stdout)
-            duration = float(data['format']['duration'])
-            return duration
+            return get_media_probe().get_duration(media_path)
             
         except Exception as e:
             print(f"获取媒体时长失败: {str(e)}")
@@ -181,7 +175,7 @@ class VideoBackgroundMusicNode:
             
             # 构建FFmpeg命令
             cmd = [
-                'ffmpeg', '-y',  # -y 覆盖输出文件
+                get_toolchain().ffmpeg, '-y',  # -y 覆盖输出文件
                 '-i', video_path,  # 输入视频
                 '-i', audio_path,  # 输入背景音乐
             ]
@@ -208,19 +202,13 @@ class VideoBackgroundMusicNode:
                 '-map', '0:v',  # 映射视频流
                 '-map', '[mixed]',  # 映射混合音频流
                 '-c:v', 'copy',  # 复制视频流，不重新编码
-                '-c:a', 'aac',  # 音频编码为AAC
-                '-b:a', '192k',  # 音频比特率
+            ] + get_audio_codec_args(audio_path, output_path, filtered=True) + [  # 混音后的音频必须重新编码
                 '-shortest',  # 以最短流为准
                 output_path
             ])
             
             print("执行FFmpeg命令...")
-            result = subprocess.run(
-                cmd, 
-                capture_output=True, 
-                text=True, 
-                timeout=600  # 10分钟超时
-            )
+            result = run_ffmpeg(cmd, timeout=600, duration=video_duration)  # 10分钟超时
             
             if result.returncode == 0:
                 print(f"背景音乐添加完成: {output_path}")
@@ -232,6 +220,8 @@ class VideoBackgroundMusicNode:
         except subprocess.TimeoutExpired:
             print("背景音乐添加超时")
             return False
+        except ProcessingInterrupted:
+            raise
         except Exception as e:
             print(f"添加背景音乐时出错: {str(e)}")
             return False
@@ -239,6 +229,7 @@ class VideoBackgroundMusicNode:
     def add_background_music(self, filename_prefix, bgm_volume=0.3, output_dir="", 
                            video_url="", video_path="", audio_url="", audio_path="", 
                            original_audio_volume=1.0):
+        job_dir = None
         try:
             # 验证输入参数
             if not video_url.strip() and not video_path.strip():
@@ -273,9 +264,14 @@ class VideoBackgroundMusicNode:
                         output_directory, filename_prefix, extension
                     )
                     
-                    if not self.download_file(video_url.strip(), output_path, "视频"):
+                    # 下载到临时工作目录，完成后再移动到输出路径
+                    scratch = get_scratch_space()
+                    job_dir = scratch.create_job_dir("background_music")
+                    staged_output = os.path.join(job_dir, output_filename)
+                    if not self.download_file(video_url.strip(), staged_output, "视频"):
                         raise RuntimeError("视频下载失败")
                     
+                    scratch.commit(staged_output, output_path)
                     return (os.path.abspath(output_path),)
                 else:
                     # 如果提供的是本地路径，直接返回
@@ -293,6 +289,10 @@ class VideoBackgroundMusicNode:
             output_directory = self._get_output_directory(output_dir)
             os.makedirs(output_directory, exist_ok=True)
             
+            # 下载文件和中间结果放在本地临时工作空间中
+            scratch = get_scratch_space()
+            job_dir = scratch.create_job_dir("background_music")
+            
             # 确定输入视频文件路径
             input_video_path = None
             temp_video_file = None
@@ -308,10 +308,7 @@ class VideoBackgroundMusicNode:
                 extension = self.get_file_extension(url_path)
                 
                 # 创建临时下载文件
-                temp_video_file = os.path.join(
-                    output_directory, 
-                    f"temp_video_{filename_prefix}_{os.getpid()}{extension}"
-                )
+                temp_video_file = os.path.join(job_dir, f"video{extension}")
                 
                 if not self.download_file(video_url.strip(), temp_video_file, "视频"):
                     raise RuntimeError("视频下载失败")
@@ -343,10 +340,7 @@ class VideoBackgroundMusicNode:
                     extension = ".mp3"  # 音频文件使用音频扩展名
                 
                 # 创建临时下载文件
-                temp_audio_file = os.path.join(
-                    output_directory, 
-                    f"temp_audio_{filename_prefix}_{os.getpid()}{extension}"
-                )
+                temp_audio_file = os.path.join(job_dir, f"audio{extension}")
                 
                 if not self.download_file(audio_url.strip(), temp_audio_file, "音频"):
                     raise RuntimeError("音频下载失败")
@@ -369,28 +363,18 @@ class VideoBackgroundMusicNode:
                 output_directory, filename_prefix, video_extension
             )
             
+            # 先写入临时工作目录，完成后再移动到输出路径
+            staged_output = os.path.join(job_dir, f"output{video_extension}")
+            
             # 添加背景音乐
             if self.add_background_music_to_video(
-                input_video_path, input_audio_path, output_path, 
+                input_video_path, input_audio_path, staged_output, 
                 bgm_volume, original_audio_volume
             ):
                 # 验证输出文件是否生成
-                if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+                if os.path.exists(staged_output) and os.path.getsize(staged_output) > 0:
+                    scratch.commit(staged_output, output_path)
                     print(f"背景音乐添加成功，输出文件: {output_path}")
-                    
-                    # 清理临时文件
-                    if temp_video_file and os.path.exists(temp_video_file):
-                        try:
-                            os.remove(temp_video_file)
-                        except:
-                            pass
-                    
-                    if temp_audio_file and os.path.exists(temp_audio_file):
-                        try:
-                            os.remove(temp_audio_file)
-                        except:
-                            pass
-                    
                     return (os.path.abspath(output_path),)
                 else:
                     raise RuntimeError("输出文件生成失败")
@@ -398,21 +382,12 @@ class VideoBackgroundMusicNode:
                 raise RuntimeError("背景音乐添加处理失败")
                 
         except Exception as e:
-            # 清理临时文件
-            if 'temp_video_file' in locals() and temp_video_file and os.path.exists(temp_video_file):
-                try:
-                    os.remove(temp_video_file)
-                except:
-                    pass
-            
-            if 'temp_audio_file' in locals() and temp_audio_file and os.path.exists(temp_audio_file):
-                try:
-                    os.remove(temp_audio_file)
-                except:
-                    pass
-            
             print(f"处理失败: {str(e)}")
             raise
+        finally:
+            # 清理临时工作目录
+            if job_dir:
+                scratch.remove_job_dir(job_dir)
 
 
 # 节点映射
@@ -1,14 +1,28 @@
 import os
-import subprocess
-import shutil
-import tempfile
 from datetime import datetime
 import folder_paths
 import glob
 import re
-from moviepy.editor import VideoFileClip, AudioFileClip, CompositeVideoClip, concatenate_videoclips, vfx
+from .media_probe import get_media_probe
+from .scratch_space import get_scratch_space
+from .segment_cache import SegmentCache
+from .stream_preflight import get_stream_signature, diff_signatures, is_encodable, build_encode_args, normalize_file
+from .ffmpeg_runner import run_ffmpeg, concat_file_line
+from .toolchain import get_toolchain
+from .media_mux import get_audio_codec_args
 
 class VideoCombineNode:
+    # 反向视频和格式转换使用的编码质量
+    REVERSE_QUALITY_PARAMS = ['-preset', 'medium', '-crf', '18']
+    # reverse滤镜会缓存整段解码后的帧，分块反向：块边界优先放在关键帧上，每块不短于该时长（秒）
+    REVERSE_CHUNK_DURATION = 2.0
+    # 每块的最大时长（秒），关键帧间隔较长时在关键帧之间按 REVERSE_CHUNK_DURATION 插入边界，限制内存占用
+    REVERSE_CHUNK_MAX_DURATION = 4.0
+    # 反向视频缓存的容量上限，同一素材多次使用往返播放时直接复用
+    REVERSE_CACHE_BYTES = 5 * 1024 ** 3
+    # 反向视频缓存目录（位于临时工作空间中），与智能视频合成的片段缓存分开淘汰
+    REVERSE_CACHE_DIR = "reverse_cache"
+
     @classmethod
     def INPUT_TYPES(cls):
         return {
@@ -49,24 +63,34 @@ class VideoCombineNode:
         video_duration = self._get_duration(video_file)
         audio_duration = self._get_duration(audio_file)
         
-        if audio_duration <= video_duration:
-            # 如果音频比视频短或相等，以音频长度为准，截断视频
-            self._merge_audio_video_with_truncated_video(video_file, audio_file, output_path)
-        else:
-            # 根据选择的处理方式处理长音频
-            if audio_handling == "cut off audio":
-                # 截断音频与视频时长保持一致
-                self._merge_audio_video_with_truncated_audio(video_file, audio_file, output_path)
-            elif audio_handling == "bounce video":
-                # 使用正/反向交替播放扩展视频
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    extended_video = self._extend_video_alternate(video_file, audio_duration, temp_dir)
-                    self._merge_audio_video(extended_video, audio_file, output_path)
-            elif audio_handling == "loop video":
-                # 循环播放视频
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    extended_video = self._extend_video_loop(video_file, audio_duration, temp_dir)
-                    self._merge_audio_video(extended_video, audio_file, output_path)
+        # 所有中间文件和输出先写入本地临时工作目录，完成后再移动到输出路径
+        scratch = get_scratch_space()
+        reserve_bytes = self._estimate_scratch_bytes(video_file, video_duration, audio_duration, audio_handling)
+        with scratch.job_dir("video_combine", reserve_bytes=reserve_bytes) as temp_dir:
+            staged_output = os.path.join(temp_dir, output_filename)
+            if audio_duration <= video_duration:
+                # 如果音频比视频短或相等，以音频长度为准，截断视频
+                self._merge_audio_video_with_truncated_video(video_file, audio_file, staged_output)
+            else:
+                # 根据选择的处理方式处理长音频
+                if audio_handling == "cut off audio":
+                    # 截断音频与视频时长保持一致
+                    self._merge_audio_video_with_truncated_audio(video_file, audio_file, staged_output)
+                elif audio_handling == "bounce video":
+                    # 使用正/反向交替播放扩展视频，拼接、裁剪和封装音频在同一次调用中完成
+                    segments_file = self._extend_video_alternate(video_file, video_duration, audio_duration, temp_dir)
+                    self._merge_extended_video(
+                        ["-f", "concat", "-safe", "0", "-i", segments_file], audio_file, audio_duration, staged_output
+                    )
+                elif audio_handling == "loop video":
+                    # 循环播放视频，循环、裁剪和封装音频在同一次调用中完成
+                    self._merge_extended_video(
+                        self._get_loop_input_args(video_file, video_duration, audio_duration, temp_dir),
+                        audio_file, audio_duration, staged_output
+                    )
+            
+            if os.path.exists(staged_output):
+                scratch.commit(staged_output, output_path)
         
         # 使用最终的绝对路径
         final_path = os.path.abspath(output_path)
@@ -106,125 +130,189 @@ class VideoCombineNode:
         new_number = max_number + 1
         return f"{prefix}_{new_number:04d}.mp4"
     
+    def _estimate_scratch_bytes(self, video_file, video_duration, audio_duration, audio_handling):
+        """预估任务目录需要的临时空间：按原视频码率估算输出文件，往返播放时再加上反向分块"""
+        size = os.path.getsize(video_file)
+        bytes_per_second = size / video_duration if video_duration > 0 else 0
+        required = bytes_per_second * max(video_duration, audio_duration)
+        if audio_duration > video_duration and audio_handling == "bounce video":
+            # 反向分块和拼接后的反向视频先写在任务目录中再移入缓存，按原视频大小的两倍估算
+            required += size * 2
+        return int(required)
+
     def _get_duration(self, media_file):
-        """获取媒体文件的时长（秒）"""
-        cmd = [
-            "ffprobe", 
-            "-v", "error", 
-            "-show_entries", "format=duration", 
-            "-of", "default=noprint_wrappers=1:nokey=1", 
-            media_file
-        ]
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        return float(result.stdout.strip())
+        """获取媒体文件的时长（秒），结果由共享的探测缓存提供"""
+        return get_media_probe().get_duration(media_file)
     
-    def _extend_video_alternate(self, video_file, target_duration, temp_dir):
-        """通过正向和反向播放交替扩展视频至目标时长"""
-        original_duration = self._get_duration(video_file)
+    def _extend_video_alternate(self, video_file, original_duration, target_duration, temp_dir):
+        """准备正向和反向交替播放的片段列表，返回可供concat分离器使用的列表文件路径"""
         
-        # 创建反向播放的视频
-        reversed_video = os.path.join(temp_dir, "reversed.mp4")
-        subprocess.run([
-            "ffmpeg", "-i", video_file, "-vf", "reverse", 
-            "-af", "areverse", reversed_video
-        ], check=True)
+        # 反向视频需要与正向视频的流参数一致，才能流复制拼接
+        signature = get_stream_signature(video_file)
+        if signature is None:
+            raise RuntimeError(f"无法获取视频流参数: {video_file}")
+        
+        # 转换后的正向视频和反向视频都按原视频的指纹缓存
+        # 使用独立的缓存目录：淘汰时按整个目录统计容量，不能与片段缓存共用
+        cache = SegmentCache(
+            self.REVERSE_CACHE_BYTES, os.path.join(get_scratch_space().root, self.REVERSE_CACHE_DIR)
+        )
+        source_file = video_file
+        forward_key = None
+        if not is_encodable(signature):
+            # 原视频的编码格式无法重新编码出来，先把正向视频转为H.264
+            signature = dict(signature, codec_name='h264', profile='High', pix_fmt='yuv420p', level=None)
+            forward_key, video_file = self._get_forward_video(cache, source_file, original_duration, signature, temp_dir)
+            signature = get_stream_signature(video_file, persist=False)
+        
+        # 创建反向播放的视频（只保留视频流，音频由后续步骤替换）
+        reverse_key = self._make_cache_key(cache, source_file, original_duration, signature, "reverse")
+        reversed_video = cache.lookup(reverse_key)
+        if reversed_video:
+            print("使用缓存的反向视频")
+        else:
+            reversed_video = cache.store(
+                reverse_key, self._reverse_video_chunked(video_file, signature, original_duration, temp_dir)
+            )
+        reversed_signature = get_stream_signature(reversed_video, persist=False)
+        
+        if forward_key is None and diff_signatures(reversed_signature, signature):
+            # 原视频的编码参数集（SPS/PPS、level）与重新编码的反向视频不同，不能放在同一个文件中流复制拼接，
+            # 正向视频也用同一编码器、相同参数转换一次（按原视频指纹缓存）
+            print("原视频与反向视频的编码参数集不同，正向视频使用相同的编码参数转换")
+            forward_key, video_file = self._get_forward_video(cache, source_file, original_duration, signature, temp_dir)
+            signature = get_stream_signature(video_file, persist=False)
+        cache.evict(protect=[reverse_key] + ([forward_key] if forward_key else []))
+        
+        mismatched = diff_signatures(reversed_signature, signature)
+        if mismatched:
+            print(f"警告: 反向视频的流参数与原视频不一致: {', '.join(mismatched)}")
         
         # 创建片段列表文件
         segments_file = os.path.join(temp_dir, "segments.txt")
-        with open(segments_file, "w") as f:
+        with open(segments_file, "w", encoding="utf-8") as f:
             segments_count = 0
             current_duration = 0
             
             while current_duration < target_duration:
                 if segments_count % 2 == 0:
                     # 正向片段
-                    f.write(f"file '{video_file}'\n")
+                    f.write(concat_file_line(video_file))
                     current_duration += original_duration
                 else:
                     # 反向片段
-                    f.write(f"file '{reversed_video}'\n")
+                    f.write(concat_file_line(reversed_video))
                     current_duration += original_duration
                 
                 segments_count += 1
         
-        # 合并所有片段
-        extended_video = os.path.join(temp_dir, "extended.mp4")
-        subprocess.run([
-            "ffmpeg", "-f", "concat", "-safe", "0", 
-            "-i", segments_file, "-c", "copy", extended_video
-        ], check=True)
-        
-        # 裁剪到精确的时长
-        final_extended = os.path.join(temp_dir, "final_extended.mp4")
-        subprocess.run([
-            "ffmpeg", "-i", extended_video, "-t", str(target_duration),
-            "-c", "copy", final_extended
-        ], check=True)
+        return segments_file
+    
+    def _get_forward_video(self, cache, source_file, duration, signature, temp_dir):
+        """把正向视频按signature的编码参数转换一次（与反向视频使用相同的编码器），返回 (缓存键, 文件路径)"""
+        forward_key = self._make_cache_key(cache, source_file, duration, signature, "forward")
+        video_file = cache.lookup(forward_key)
+        if video_file:
+            print("使用缓存的H.264正向视频")
+            return forward_key, video_file
+        forward_video = os.path.join(temp_dir, "forward.mp4")
+        if not normalize_file(source_file, forward_video, signature, self.REVERSE_QUALITY_PARAMS):
+            raise RuntimeError(f"正向视频格式转换失败: {source_file}")
+        return forward_key, cache.store(forward_key, forward_video)
+    
+    def _make_cache_key(self, cache, source_file, duration, signature, kind):
+        """反向/转换视频的缓存键：原视频指纹 + 输出编码参数"""
+        preset = " ".join([kind] + build_encode_args(signature, self.REVERSE_QUALITY_PARAMS))
+        return cache.make_key(source_file, 0, duration, signature.get('width'), signature.get('height'), preset)
+    
+    def _get_reverse_chunks(self, video_file, duration):
+        """把视频划分为若干块，返回 [(起始时间, 时长)]
         
-        return final_extended
+        每块都从输入定位后重新编码，边界不必是关键帧；边界优先放在关键帧上（定位时解码最少），
+        相邻关键帧相距过远（长GOP或只有第一个关键帧）时按固定时长插入边界，每块不超过 REVERSE_CHUNK_MAX_DURATION
+        """
+        keyframes = sorted(t for t in get_media_probe().get_keyframes(video_file) if 0 < t < duration)
+        boundaries = [0.0]
+        for t in keyframes + [duration]:
+            while t - boundaries[-1] > self.REVERSE_CHUNK_MAX_DURATION:
+                boundaries.append(boundaries[-1] + self.REVERSE_CHUNK_DURATION)
+            if t < duration and t - boundaries[-1] >= self.REVERSE_CHUNK_DURATION and duration - t > 0.1:
+                boundaries.append(t)
+        boundaries.append(duration)
+        return [(start, end - start) for start, end in zip(boundaries, boundaries[1:])]
     
-    def _extend_video_loop(self, video_file, target_duration, temp_dir):
-        """通过循环播放扩展视频至目标时长"""
-        original_duration = self._get_duration(video_file)
+    def _reverse_video_chunked(self, video_file, signature, duration, temp_dir):
+        """分块反向视频：每块单独反向后按相反顺序流复制拼接，内存占用只与块长度有关"""
+        chunks = self._get_reverse_chunks(video_file, duration)
+        print(f"分 {len(chunks)} 块创建反向视频")
         
-        # 创建片段列表文件
-        segments_file = os.path.join(temp_dir, "segments.txt")
-        with open(segments_file, "w") as f:
-            current_duration = 0
-            
-            while current_duration < target_duration:
-                # 循环添加相同视频
-                f.write(f"file '{video_file}'\n")
-                current_duration += original_duration
-        
-        # 合并所有片段
-        extended_video = os.path.join(temp_dir, "extended.mp4")
-        subprocess.run([
-            "ffmpeg", "-f", "concat", "-safe", "0", 
-            "-i", segments_file, "-c", "copy", extended_video
-        ], check=True)
+        chunk_files = []
+        for i, (start, chunk_duration) in enumerate(chunks):
+            chunk_file = os.path.join(temp_dir, f"reversed_{i:04d}.mp4")
+            run_ffmpeg(
+                [get_toolchain().ffmpeg, "-y", "-ss", f"{start:.6f}", "-i", video_file, "-t", f"{chunk_duration:.6f}",
+                 "-map", "0:v:0"]
+                + build_encode_args(signature, self.REVERSE_QUALITY_PARAMS, ["reverse"])
+                + ["-an", chunk_file],
+                duration=chunk_duration, check=True
+            )
+            chunk_files.append(chunk_file)
         
-        # 裁剪到精确的时长
-        final_extended = os.path.join(temp_dir, "final_extended.mp4")
-        subprocess.run([
-            "ffmpeg", "-i", extended_video, "-t", str(target_duration),
-            "-c", "copy", final_extended
-        ], check=True)
+        reversed_video = os.path.join(temp_dir, "reversed.mp4")
+        if len(chunk_files) == 1:
+            os.replace(chunk_files[0], reversed_video)
+            return reversed_video
         
-        return final_extended
+        chunks_file = os.path.join(temp_dir, "reversed_chunks.txt")
+        with open(chunks_file, "w", encoding="utf-8") as f:
+            for chunk_file in reversed(chunk_files):
+                f.write(concat_file_line(chunk_file))
+        run_ffmpeg([
+            get_toolchain().ffmpeg, "-y", "-f", "concat", "-safe", "0",
+            "-i", chunks_file, "-map", "0:v:0", "-c", "copy", reversed_video
+        ], duration=duration, check=True)
+        for chunk_file in chunk_files:
+            os.remove(chunk_file)
+        return reversed_video
+    
+    def _get_loop_input_args(self, video_file, original_duration, target_duration, temp_dir):
+        """循环播放的视频输入参数：优先使用 -stream_loop，旧版FFmpeg不支持时改用concat片段列表"""
+        if get_toolchain().supports('stream_loop'):
+            return ["-stream_loop", "-1", "-i", video_file]
+        
+        segments_file = os.path.join(temp_dir, "segments.txt")
+        with open(segments_file, "w", encoding="utf-8") as f:
+            for _ in range(int(target_duration // max(original_duration, 0.1)) + 1):
+                f.write(concat_file_line(video_file))
+        return ["-f", "concat", "-safe", "0", "-i", segments_file]
     
     def _merge_audio_video_with_truncated_audio(self, video_file, audio_file, output_file):
         """合并视频与截断后的音频"""
-        # 获取视频时长
-        video_duration = self._get_duration(video_file)
-        
         # 直接使用ffmpeg将视频和截断的音频合并为一个文件
         # 使用-shortest参数确保输出时长与视频相同，音频将被截断
-        subprocess.run([
-            "ffmpeg", "-y", "-i", video_file, "-i", audio_file,
+        run_ffmpeg([
+            get_toolchain().ffmpeg, "-y", "-i", video_file, "-i", audio_file,
             "-map", "0:v", "-map", "1:a", 
-            "-c:v", "copy", "-c:a", "aac",
+            "-c:v", "copy"] + get_audio_codec_args(audio_file, output_file) + [
             "-shortest", output_file
         ], check=True)
     
     def _merge_audio_video_with_truncated_video(self, video_file, audio_file, output_file):
         """合并音频与截断后的视频，以音频长度为准"""
-        # 获取音频时长
-        audio_duration = self._get_duration(audio_file)
-        
         # 直接使用ffmpeg将截断的视频和音频合并为一个文件
         # 使用-shortest参数确保输出时长与音频相同，视频将被截断
-        subprocess.run([
-            "ffmpeg", "-y", "-i", video_file, "-i", audio_file,
+        run_ffmpeg([
+            get_toolchain().ffmpeg, "-y", "-i", video_file, "-i", audio_file,
             "-map", "0:v", "-map", "1:a", 
-            "-c:v", "copy", "-c:a", "aac",
+            "-c:v", "copy"] + get_audio_codec_args(audio_file, output_file) + [
             "-shortest", output_file
         ], check=True)
     
-    def _merge_audio_video(self, video_file, audio_file, output_file):
-        """合并音频与视频"""
-        subprocess.run([
-            "ffmpeg", "-y", "-i", video_file, "-i", audio_file,
-            "-map", "0:v", "-map", "1:a", 
-            "-c:v", "copy", "-c:a", "aac", output_file
-        ], check=True) 
\ No newline at end of file
+    def _merge_extended_video(self, video_input_args, audio_file, target_duration, output_file):
+        """把扩展后的视频输入（循环或片段列表）裁剪到目标时长并封装音频，视频流只复制不重新编码"""
+        run_ffmpeg([
+            get_toolchain().ffmpeg, "-y"] + video_input_args + ["-i", audio_file,
+            "-map", "0:v:0", "-map", "1:a",
+            "-t", str(target_duration),
+            "-c:v", "copy"] + get_audio_codec_args(audio_file, output_file) + [output_file
+        ], duration=target_duration, check=True) 
\ No newline at end of file
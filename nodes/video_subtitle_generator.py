@@ -4,8 +4,6 @@ import tempfile
 import folder_paths
 import glob
 import re
-from moviepy.editor import VideoFileClip, AudioFileClip, TextClip, CompositeVideoClip, CompositeAudioClip, afx
-from moviepy.video.tools.subtitles import SubtitlesClip
 from PIL import Image, ImageFont, ImageDraw
 import numpy as np
 
@@ -51,6 +49,8 @@ class VideoSubtitleGeneratorNode:
                               subtitle_position="bottom", custom_position=85.0,
                               bgm_file="", bgm_volume=0.3, voice_volume=1.0):
         """生成带字幕的视频"""
+        # moviepy导入较慢，在首次执行时再导入，不影响ComfyUI启动
+        from moviepy.editor import VideoFileClip, AudioFileClip, CompositeAudioClip, afx
         
         # 验证输入文件
         if not os.path.exists(video_file):
@@ -159,6 +159,8 @@ class VideoSubtitleGeneratorNode:
                           bg_color, stroke_color, stroke_width, subtitle_position,
                           custom_position, video_width, video_height):
         """添加SRT字幕文件"""
+        from moviepy.editor import TextClip, CompositeVideoClip
+        from moviepy.video.tools.subtitles import SubtitlesClip
         
         def make_textclip(text):
             return TextClip(
@@ -196,6 +198,7 @@ class VideoSubtitleGeneratorNode:
                            bg_color, stroke_color, stroke_width, subtitle_position,
                            custom_position, video_width, video_height):
         """添加文本字幕"""
+        from moviepy.editor import CompositeVideoClip
         
         # 解析字幕文本 (格式: "0.0-5.0 这是第一句字幕")
         text_clips = []
@@ -237,6 +240,7 @@ class VideoSubtitleGeneratorNode:
                          stroke_color, stroke_width, subtitle_position, custom_position,
                          video_width, video_height):
         """创建单个字幕片段"""
+        from moviepy.editor import TextClip
         
         time_info, text = subtitle_item
         start_time, end_time = time_info
@@ -0,0 +1,114 @@
+"""
+ComfyUI-ToolBox 导入耗时基准
+
+用法:
+    python scripts/benchmark_import_time.py --comfyui-dir /path/to/ComfyUI [--budget-ms 300] [--runs 5]
+
+在全新的Python进程中导入节点包（预先导入ComfyUI启动时已经加载的 torch/numpy/PIL/folder_paths，
+只统计本包自身的开销），输出多次运行的耗时和 -X importtime 中最慢的模块。
+耗时超过预算，或启动时导入了 moviepy/boto3/pydub/scipy/soundfile/requests 等重量级依赖时返回非零退出码，
+可在提交前或CI中运行，防止启动性能回退。
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 这些依赖只能在节点首次执行时导入
+HEAVY_MODULES = ('moviepy', 'boto3', 'botocore', 'pydub', 'scipy', 'soundfile', 'requests')
+
+# ComfyUI启动时已经加载的模块，不计入本包的导入耗时
+PRELOADED_MODULES = ('torch', 'numpy', 'PIL.Image', 'folder_paths')
+
+CHILD_SCRIPT = """
+import sys, json, time, importlib, importlib.util
+sys.path.insert(0, {comfyui_dir!r})
+for name in {preloaded!r}:
+    importlib.import_module(name)
+before = set(sys.modules)
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location(
+    "comfyui_toolbox", {init_path!r}, submodule_search_locations=[{package_dir!r}]
+)
+module = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = module
+spec.loader.exec_module(module)
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "elapsed_ms": elapsed * 1000,
+    "nodes": len(module.NODE_CLASS_MAPPINGS),
+    "modules": sorted(set(sys.modules) - before),
+}}))
+"""
+
+_IMPORTTIME_PATTERN = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def run_child(comfyui_dir, importtime=False):
+    """在子进程中导入节点包，返回 (结果, stderr)"""
+    script = CHILD_SCRIPT.format(
+        comfyui_dir=comfyui_dir,
+        preloaded=PRELOADED_MODULES,
+        init_path=os.path.join(PACKAGE_DIR, "__init__.py"),
+        package_dir=PACKAGE_DIR,
+    )
+    cmd = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', script]
+    result = subprocess.run(cmd, capture_output=True, text=True, cwd=comfyui_dir)
+    if result.returncode != 0:
+        raise RuntimeError(f"导入节点包失败:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(importtime_output, modules, limit):
+    """从 -X importtime 输出中找出本包导入的最慢的顶层模块"""
+    entries = []
+    for line in importtime_output.splitlines():
+        match = _IMPORTTIME_PATTERN.match(line)
+        if match and match.group(4) in modules:
+            entries.append((int(match.group(2)) / 1000, match.group(4)))
+    return sorted(entries, reverse=True)[:limit]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ComfyUI-ToolBox 导入耗时基准")
+    parser.add_argument("--comfyui-dir", required=True, help="ComfyUI目录（用于导入folder_paths）")
+    parser.add_argument("--runs", type=int, default=5, help="运行次数")
+    parser.add_argument("--budget-ms", type=float, default=300.0, help="导入耗时预算（毫秒，取中位数比较）")
+    parser.add_argument("--top", type=int, default=10, help="显示最慢的模块数量")
+    args = parser.parse_args(argv)
+
+    comfyui_dir = os.path.abspath(args.comfyui_dir)
+    timings = []
+    result = None
+    for _ in range(max(1, args.runs)):
+        result, _ = run_child(comfyui_dir)
+        timings.append(result['elapsed_ms'])
+
+    median = statistics.median(timings)
+    print(f"注册节点: {result['nodes']} 个")
+    print(f"导入耗时: 中位数 {median:.1f}ms，最小 {min(timings):.1f}ms，最大 {max(timings):.1f}ms（{len(timings)} 次）")
+
+    _, importtime_output = run_child(comfyui_dir, importtime=True)
+    print("最慢的模块（累计耗时）:")
+    for cumulative_ms, name in slowest_imports(importtime_output, set(result['modules']), args.top):
+        print(f"  {cumulative_ms:8.1f}ms  {name}")
+
+    failed = False
+    heavy = sorted(name for name in result['modules'] if name.split('.')[0] in HEAVY_MODULES)
+    if heavy:
+        top_level = sorted({name.split('.')[0] for name in heavy})
+        print(f"错误: 启动时导入了重量级依赖: {', '.join(top_level)}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"错误: 导入耗时 {median:.1f}ms 超过预算 {args.budget_ms:.1f}ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())